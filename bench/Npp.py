@@ -0,0 +1,17 @@
+# encoding=utf-8
+"""Stand-in for the PythonScript plugin's Npp module, so pyscFilteredViewerLibrary can be driven outside of Notepad++
+
+This is the same stand-in that the library itself falls back to outside of Notepad++ (pyscFilteredViewer/pyscfvHeadless.py);
+it's here under the Npp name so the benchmark drives the library exactly as if it were running in PythonScript.
+Buffers are simulated by notepad.openBuffer(), and notification callbacks are run
+synchronously (in the calling thread) by notepad.notify().
+"""
+import os
+import sys
+
+_scripts = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pyscFilteredViewer')
+if _scripts not in sys.path:
+    sys.path.append(_scripts)
+
+from pyscfvHeadless import *
+from pyscfvHeadless import __all__
@@ -0,0 +1,173 @@
+# encoding=utf-8
+"""Import-time benchmark for the pyscFilteredViewer helper scripts
+
+Every menu action (each pyscFilteredViewer\\*.py helper script) starts by importing pyscFilteredViewerLibrary.
+PythonScript keeps imported modules for the rest of the Notepad++ session, so the first action of a session
+pays for the import (and for any first-use initialization), and the later ones don't.  For each action, in a
+fresh python process each time (with the Npp stand-in from this folder), this times
+    cold    the first run of the script in a session, including the library import
+    warm    a second run of the same script in the same session
+and lists which of the heavier modules (ConfigParser, zlib, ...) were loaded by the cold run.  The measuring
+process imports nothing but sys, os, time, and the Npp stand-in before the cold run (the config file and the
+input file are written by the parent process), so every module that the library or the action loads shows up.
+The import action is just the library import, on its own.  The pyscFilteredViewer and
+pyscfvToggleFilterOnSave actions also filter a small file, with bench/filters/to_html.py.
+
+PythonScript imports the library from its .pyc file, so that's what is measured: the benchmark copies the
+pyscFilteredViewer and bench folders to a temporary folder, compiles them there, and runs the actions from
+the copy (so no .pyc files are written into the repository).
+
+Run it with the same python 2.7 that PythonScript uses, from the top of the repository:
+    python bench/bench_import.py [--iterations 10] [--actions import,pyscFilteredViewer,...] [--json results.json]
+"""
+import sys
+import os
+from time import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+SCRIPTS = os.path.join(ROOT, 'pyscFilteredViewer')
+ACTIONS = ['import', 'pyscFilteredViewer', 'pyscfvEditConfig', 'pyscfvShowStats', 'pyscfvToggleFilterOnSave',
+           'pyscfvRegisterFilterOnSave', 'pyscfvUnRegisterFilterOnSave', 'pyscfvBatchRender']
+HEAVY = ['ConfigParser', 'configparser', 'ctypes', 'subprocess', 'zlib', 'json', 'hashlib', 'shutil', 'fnmatch', 'tempfile']
+
+def run_action(action):
+    """runs the action once, the way PythonScript runs a script (as __main__, in a fresh namespace)"""
+    if action == 'import':
+        import pyscFilteredViewerLibrary
+        return
+    path = os.path.join(SCRIPTS, action + '.py')
+    with open(path) as f:
+        code = compile(f.read(), path, 'exec')
+    exec(code, dict(__name__='__main__', __file__=path))
+
+class WintypesStandIn(object):
+    """import hook that supplies ctypes.wintypes outside of windows (with a user32 that finds no Notepad++ window),
+    only when the library imports it, so that ctypes itself is still loaded by the action being measured"""
+    def find_module(self, fullname, path=None):
+        return self if fullname == 'ctypes.wintypes' else None
+    def load_module(self, fullname):
+        class User32(object):
+            def FindWindowW(self, *args): return 0
+            def SendMessageW(self, *args): return 0
+        wintypes = sys.modules[fullname] = type(sys)(fullname)
+        wintypes.WinDLL = lambda name: User32()
+        return wintypes
+
+def child(action, workdir):
+    """the body of one measurement process: prints dict(cold, warm, loaded) as JSON on STDOUT"""
+    sys.path.insert(0, BENCH)                                   # the Npp stand-in
+    sys.path.insert(1, SCRIPTS)
+    if os.name != 'nt':
+        sys.meta_path.append(WintypesStandIn())
+        os.startfile = lambda fname: None
+    webbrowser = sys.modules['webbrowser'] = type(sys)('webbrowser')
+    webbrowser.open = lambda url: True                          # never launch a real viewer
+    import Npp
+    Npp.console.quiet = True
+    Npp.notepad.pluginConfigDir = os.path.join(workdir, 'config')
+    Npp.notepad.openBuffer(os.path.join(workdir, 'input.benchfile'))
+
+    before = set(sys.modules)
+    start = time()
+    run_action(action)
+    cold = time() - start
+    loaded = sorted( m for m in HEAVY if sys.modules.get(m) is not None and m not in before )
+    warm = None
+    if action != 'import':
+        start = time()
+        run_action(action)
+        warm = time() - start
+
+    # let background work (FilterOnSave renders, batch renders) finish before the workdir goes away
+    import json
+    import threading
+    lib = sys.modules['pyscFilteredViewerLibrary']
+    lib.pyscfv_waitForRenders(30)
+    lib.pyscfv_stopDependencyWatcher()
+    lib.pyscfv_stopFilterServers()
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join(30)
+    sys.stdout.write(json.dumps(dict(cold=cold, warm=warm, loaded=loaded)) + '\n')
+
+def compiled_copy():
+    """copies the pyscFilteredViewer and bench folders to a new temporary folder, and compiles them there; returns the folder"""
+    import shutil
+    import tempfile
+    import compileall
+    copy = tempfile.mkdtemp(prefix='pyscfv-bench-import-src-')
+    for folder in ('pyscFilteredViewer', 'bench'):
+        shutil.copytree(os.path.join(ROOT, folder), os.path.join(copy, folder), ignore=shutil.ignore_patterns('*.pyc', '__pycache__'))
+        compileall.compile_dir(os.path.join(copy, folder), quiet=1)
+    return copy
+
+def measure(action, iterations, copy):
+    """runs the action in iterations fresh processes (from the compiled copy); returns the result dict for the table"""
+    import json
+    import shutil
+    import tempfile
+    import subprocess
+    import Npp
+    import bench_render
+    colds, warms, loaded = [], [], set()
+    for i in range(iterations):
+        workdir = tempfile.mkdtemp(prefix='pyscfv-bench-import-')
+        try:
+            Npp.notepad.pluginConfigDir = os.path.join(workdir, 'config')
+            os.makedirs(Npp.notepad.pluginConfigDir)
+            bench_render.write_config(Npp.notepad, ['file'])
+            bench_render.make_input(os.path.join(workdir, 'input.benchfile'), 1024, 'import')
+            env = dict(os.environ, TMPDIR=workdir, TEMP=workdir, TMP=workdir)    # (where tempfile.gettempdir() looks)
+            p = subprocess.Popen( [sys.executable, os.path.join(copy, 'bench', 'bench_import.py'), '--child', action, workdir], stdout=subprocess.PIPE, env=env )
+            out = p.communicate()[0]
+            if p.returncode:
+                raise RuntimeError('{} failed with exit code {}'.format(action, p.returncode))
+            sample = json.loads(out.splitlines()[-1])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        colds.append(sample['cold'])
+        if sample['warm'] is not None:
+            warms.append(sample['warm'])
+        loaded.update(sample['loaded'])
+    from bench_render import percentile
+    return dict(action=action, iterations=iterations,
+                cold_p50=percentile(colds, 50), cold_max=max(colds),
+                warm_p50=percentile(warms, 50) if warms else None, warm_max=max(warms) if warms else None,
+                loaded=sorted(loaded))
+
+def main(argv):
+    if argv[:1] == ['--child']:
+        child(*argv[1:])                # (before anything else is imported)
+        return 0
+
+    import json
+    import shutil
+    import optparse
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--iterations', type='int', default=10, help='fresh processes per action')
+    parser.add_option('--actions', default=','.join(ACTIONS), help='comma-separated actions: ' + ', '.join(ACTIONS))
+    parser.add_option('--json', help='also write the results to this file, as JSON')
+    opts, args = parser.parse_args(argv)
+
+    sys.dont_write_bytecode = True      # (this process imports the stand-in and the helpers from the repository itself)
+    sys.path.insert(0, BENCH)
+    import Npp
+    Npp.console.quiet = True
+    copy = compiled_copy()
+    try:
+        results = [ measure(a.strip(), opts.iterations, copy) for a in opts.actions.split(',') ]
+    finally:
+        shutil.rmtree(copy, ignore_errors=True)
+
+    ms = lambda t: '-' if t is None else '{:.1f}'.format(t * 1000)
+    print('{:<30} {:>12} {:>12} {:>12} {:>12}  {}'.format('action', 'cold p50 ms', 'cold max ms', 'warm p50 ms', 'warm max ms', 'heavy modules loaded'))
+    for r in results:
+        print('{:<30} {:>12} {:>12} {:>12} {:>12}  {}'.format(r['action'], ms(r['cold_p50']), ms(r['cold_max']), ms(r['warm_p50']), ms(r['warm_max']), ' '.join(r['loaded']) or '-'))
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,182 @@
+# encoding=utf-8
+"""Headless benchmark for the pyscFilteredViewer render path
+
+Drives pyscFilteredViewerLibrary outside of Notepad++, using the Npp stand-in in this folder:
+for each reference filter and each input size, it times
+    oneshot-cold    pyscfv_FilteredViewer() on a file whose contents change every run
+    oneshot-cached  pyscfv_FilteredViewer() on a file whose contents don't change (so the render cache is used)
+    onsave          pyscfv_Callback_FilterOnSave() after pyscfv_Register_FilterOnSave(), on a file that
+                    changes every save: "stall" is how long the callback blocked, "latency" is the time
+                    until the new render was published
+and prints a table of the results.  The reference filters are
+    file            bench/filters/to_html.py, reading the file named by %1
+    stdin           the same, with Input=stdin
+    server          pyscFilteredViewer/ExampleFilterServer.py, with Server=1
+    plugin          pyscFilteredViewer/ExampleFilterPlugin.py, as an in-process filter plugin
+
+Run it with the same python 2.7 that PythonScript uses, from the top of the repository:
+    python bench/bench_render.py [--sizes 1k,100k,1m] [--iterations 10] [--filters file,plugin,server,stdin] [--json results.json]
+"""
+import sys
+import os
+import json
+import shutil
+import tempfile
+import optparse
+from time import time
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH)
+FILTERS = dict(
+    file    = '[BenchFile]\nExtension=.benchfile\nCommand="{python}" "{bench}/filters/to_html.py" "%1"\n',
+    stdin   = '[BenchStdin]\nExtension=.benchstdin\nInput=stdin\nCommand="{python}" "{bench}/filters/to_html.py"\n',
+    server  = '[BenchServer]\nExtension=.benchserver\nServer=1\nCommand="{python}" "{root}/pyscFilteredViewer/ExampleFilterServer.py"\n',
+    plugin  = '[BenchPlugin]\nExtension=.benchplugin\nCommand=python:{root}/pyscFilteredViewer/ExampleFilterPlugin.py:render\n',
+)
+
+def parse_size(text):
+    """'100k' => 102400"""
+    units = dict(k=1024, m=1024*1024)
+    text = text.strip().lower()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def install_stand_ins(workdir):
+    """makes the library importable outside of Notepad++ (and outside of windows), with its temp files under workdir"""
+    sys.path.insert(0, BENCH)                                   # the Npp stand-in
+    sys.path.insert(1, os.path.join(ROOT, 'pyscFilteredViewer'))
+    try:
+        import ctypes.wintypes
+        ctypes.wintypes.WinDLL
+    except (ImportError, ValueError, AttributeError):
+        # not on windows: there's no Notepad++ window to send messages to anyway
+        import types
+        import ctypes
+        class User32(object):
+            def FindWindowW(self, *args): return 0
+            def SendMessageW(self, *args): return 0
+        wintypes = types.ModuleType('ctypes.wintypes')
+        wintypes.WinDLL = lambda name: User32()
+        ctypes.wintypes = wintypes
+        sys.modules['ctypes.wintypes'] = wintypes
+    if not hasattr(os, 'startfile'):
+        os.startfile = lambda fname: None
+    import webbrowser
+    webbrowser.open = lambda url: True                          # never launch a real viewer
+    tempfile.tempdir = workdir
+
+def write_config(notepad, filters):
+    """writes the benchmark config file where pyscfv_establishConfigFile() will look for it"""
+    cfgdir = notepad.getPluginConfigDir() + r'\pyscFilteredViewer'     # (the same concatenation the library does)
+    if not os.path.isdir(cfgdir):
+        os.makedirs(cfgdir)
+    with open(cfgdir + r'\pyscFilteredViewer.ini', 'w') as f:
+        for name in filters:
+            f.write(FILTERS[name].format(python=sys.executable, bench=BENCH, root=ROOT))
+
+def make_input(path, size, marker):
+    """writes size bytes of text to path, starting with marker so that different runs have different contents"""
+    line = 'The quick brown fox jumps over the lazy dog; pack my box with five dozen liquor jugs.\n'
+    body = (line * (size // len(line) + 1))[:max(size - len(marker) - 1, 0)]
+    with open(path, 'wb') as f:
+        f.write(marker + '\n' + body)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    rank = int(-(-len(ordered) * pct // 100))
+    return ordered[max(rank, 1) - 1]
+
+def bench_one(lib, Npp, name, size, iterations, workdir):
+    """runs the three scenarios for one filter and one size; returns a list of result dicts"""
+    ext = dict(file='.benchfile', stdin='.benchstdin', server='.benchserver', plugin='.benchplugin')[name]
+    src = os.path.join(workdir, 'input-{}{}'.format(size, ext))
+    Npp.notepad.openBuffer(src)
+    results = []
+
+    def record(scenario, metric, samples):
+        p50 = percentile(samples, 50)
+        results.append(dict(filter=name, size=size, scenario=scenario, metric=metric, iterations=len(samples),
+                            p50=p50, p95=percentile(samples, 95), max=max(samples),
+                            mbps=(size / 1048576.0) / p50 if p50 > 0 else float('inf')))
+
+    # warm up (starts a filter server, fills the OS file cache) without counting it
+    make_input(src, size, 'warmup')
+    lib.pyscfv_FilteredViewer()
+
+    samples = []
+    for i in range(iterations):
+        make_input(src, size, 'oneshot-cold {}'.format(i))
+        start = time()
+        lib.pyscfv_FilteredViewer()
+        samples.append(time() - start)
+    record('oneshot-cold', 'latency', samples)
+
+    samples = []
+    for i in range(iterations):
+        start = time()
+        lib.pyscfv_FilteredViewer()
+        samples.append(time() - start)
+    record('oneshot-cached', 'latency', samples)
+
+    lib.pyscfv_Register_FilterOnSave()
+    stalls, latencies = [], []
+    for i in range(iterations):
+        make_input(src, size, 'onsave {}'.format(i))
+        start = time()
+        Npp.notepad.notify(Npp.NOTIFICATION.FILESAVED, bufferID=Npp.notepad.getCurrentBufferID())
+        stalls.append(time() - start)
+        lib.pyscfv_waitForRenders()
+        latencies.append(time() - start)
+    lib.pyscfv_UnRegister_FilterOnSave()
+    record('onsave', 'stall', stalls)
+    record('onsave', 'latency', latencies)
+    return results
+
+def main(argv):
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--sizes', default='1k,100k,1m', help='comma-separated input sizes (k and m suffixes allowed)')
+    parser.add_option('--iterations', type='int', default=10, help='timed runs per scenario')
+    parser.add_option('--filters', default=','.join(sorted(FILTERS)), help='comma-separated reference filters: ' + ', '.join(sorted(FILTERS)))
+    parser.add_option('--json', help='also write the results to this file, as JSON')
+    parser.add_option('--stats', action='store_true', help="also print the library's own per-stage timings (pyscfv_showStats)")
+    parser.add_option('--keep', action='store_true', help="don't delete the temporary working folder")
+    opts, args = parser.parse_args(argv)
+    sizes = [ parse_size(s) for s in opts.sizes.split(',') ]
+    filters = [ f.strip() for f in opts.filters.split(',') ]
+
+    workdir = tempfile.mkdtemp(prefix='pyscfv-bench-')
+    install_stand_ins(workdir)
+    import Npp
+    Npp.console.quiet = True
+    Npp.notepad.pluginConfigDir = os.path.join(workdir, 'config')
+    os.makedirs(Npp.notepad.pluginConfigDir)
+    write_config(Npp.notepad, filters)
+    import pyscFilteredViewerLibrary as lib
+
+    results = []
+    try:
+        for name in filters:
+            for size in sizes:
+                results.extend( bench_one(lib, Npp, name, size, opts.iterations, workdir) )
+    finally:
+        lib.pyscfv_stopFilterServers()
+        if not opts.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print('{:<8} {:>10} {:<15} {:<8} {:>10} {:>10} {:>10} {:>10}'.format('filter', 'bytes', 'scenario', 'metric', 'p50 ms', 'p95 ms', 'max ms', 'MB/s'))
+    for r in results:
+        print('{filter:<8} {size:>10} {scenario:<15} {metric:<8} {0:>10.1f} {1:>10.1f} {2:>10.1f} {mbps:>10.1f}'.format(r['p50']*1000, r['p95']*1000, r['max']*1000, **r))
+    if opts.stats:
+        Npp.console.quiet = False
+        lib.pyscfv_showStats()
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if Npp.notepad.messages:
+        sys.stderr.write('message boxes: {}\n'.format(Npp.notepad.messages))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
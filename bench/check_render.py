@@ -0,0 +1,164 @@
+# encoding=utf-8
+"""Headless regression checks for the pyscFilteredViewer render path
+
+Drives pyscFilteredViewerLibrary outside of Notepad++, using the Npp stand-in in this folder (the same one the
+benchmarks use), and checks the behavior that the benchmarks only time:
+    cache           a second render of unchanged contents is served from the render cache (the filter doesn't run
+                    again), and a render of changed contents isn't
+    timeout         a filter that hangs is stopped after Timeout= seconds, and the output says so
+    pipeline        Command2= reads the output of Command= through a pipe, and both stages are in the pipeline report
+    dependencies    when a file that the filter reported as a dependency changes, the output is rendered again
+The filters are bench/filters/check_filter.py.  It prints PASS or FAIL for each check, and exits with 1 if any failed.
+
+Run it with the same python 2.7 that PythonScript uses, from the top of the repository:
+    python bench/check_render.py [--checks cache,timeout,pipeline,dependencies] [--keep]
+"""
+import sys
+import os
+import shutil
+import tempfile
+import optparse
+import traceback
+from time import time, sleep
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+CONFIG = '''[CheckCache]
+Extension=.cache
+Command="{python}" "{filter}" count "{workdir}/count.txt" "%1"
+
+[CheckTimeout]
+Extension=.hang
+Command="{python}" "{filter}" hang "{workdir}/heartbeat.txt"
+Timeout=1
+
+[CheckPipeline]
+Extension=.pipe
+Command="{python}" "{filter}" count "{workdir}/pipe-count.txt" "%1"
+Command2="{python}" "{filter}" upper
+
+[CheckDependencies]
+Extension=.dep
+Command="{python}" "{filter}" include "%1"
+'''
+
+def render(lib, src):
+    """one-shot render of src with the section that matches it; returns (output path, output contents)"""
+    cfgDict = lib.pyscfv_getConfigDict()
+    section = lib.pyscfv_matchSection(cfgDict, src, None)
+    options = cfgDict['config'][section]
+    dst = lib.pyscfv_filter_file(options['command'], src, section, options=options)
+    with open(dst, 'rb') as f:
+        return dst, f.read()
+
+def write(path, text):
+    with open(path, 'wb') as f:
+        f.write(text)
+
+def runs(path):
+    """how many times the counting filter has run"""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return len(f.read().splitlines())
+
+def check_cache(lib, workdir):
+    src = os.path.join(workdir, 'doc.cache')
+    count = os.path.join(workdir, 'count.txt')
+    write(src, b'first version')
+    dst, first = render(lib, src)
+    assert runs(count) == 1, 'the filter ran {} times for the first render'.format(runs(count))
+    assert b'first version' in first, 'unexpected output: {!r}'.format(first)
+    dst, again = render(lib, src)
+    assert runs(count) == 1, 'the filter ran again for unchanged contents'
+    assert again == first, 'the cached output differs: {!r}'.format(again)
+    write(src, b'second version')
+    dst, changed = render(lib, src)
+    assert runs(count) == 2, 'the filter did not run again for changed contents'
+    assert b'second version' in changed, 'stale output for changed contents: {!r}'.format(changed)
+
+def check_timeout(lib, workdir):
+    src = os.path.join(workdir, 'doc.hang')
+    heartbeat = os.path.join(workdir, 'heartbeat.txt')
+    write(src, b'hangs')
+    start = time()
+    dst, output = render(lib, src)
+    seconds = time() - start
+    assert seconds < 10, 'the hung filter was only stopped after {:.1f} seconds'.format(seconds)
+    assert b'took longer than Timeout=1 seconds' in output, 'the output does not say why: {!r}'.format(output)
+    sleep(0.5)
+    size = os.path.getsize(heartbeat)
+    sleep(1)
+    assert os.path.getsize(heartbeat) == size, 'the hung filter is still running'
+
+def check_pipeline(lib, workdir):
+    src = os.path.join(workdir, 'doc.pipe')
+    write(src, b'piped text')
+    dst, output = render(lib, src)
+    assert b'<HTML><XMP>PIPED TEXT</XMP></HTML>' in output, 'unexpected output: {!r}'.format(output)
+    report = lib.pyscfv_getPipelineReport(dst) or []
+    assert [ r['stage'] for r in report ] == [1, 2], 'unexpected pipeline report: {!r}'.format(report)
+    assert not [ r for r in report if r['exitcode'] ], 'a stage failed: {!r}'.format(report)
+
+def check_dependencies(lib, workdir):
+    src = os.path.join(workdir, 'doc.dep')
+    inc = os.path.join(workdir, 'inc.txt')
+    write(src, b'main text')
+    write(inc, b'included v1')
+    dst, output = render(lib, src)
+    assert b'included v1' in output, 'unexpected output: {!r}'.format(output)
+    assert lib.pyscfv_checkDependencies() == [], 'a dependency looked changed before it was'
+    write(inc, b'included v2, longer')
+    affected = lib.pyscfv_checkDependencies()
+    assert affected == [dst], 'the change to inc.txt re-rendered {!r}'.format(affected)
+    assert lib.pyscfv_waitForRenders(30), 'the re-render did not finish'
+    with open(dst, 'rb') as f:
+        output = f.read()
+    assert b'included v2, longer' in output, 'the output was not re-rendered: {!r}'.format(output)
+
+CHECKS = [ ('cache', check_cache), ('timeout', check_timeout), ('pipeline', check_pipeline), ('dependencies', check_dependencies) ]
+
+def main(argv):
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--checks', default=','.join( name for name, check in CHECKS ), help='comma-separated checks: ' + ', '.join( name for name, check in CHECKS ))
+    parser.add_option('--keep', action='store_true', help="don't delete the temporary working folder")
+    opts, args = parser.parse_args(argv)
+    wanted = [ c.strip() for c in opts.checks.split(',') ]
+
+    sys.path.insert(0, BENCH)
+    import bench_render
+    workdir = tempfile.mkdtemp(prefix='pyscfv-check-')
+    bench_render.install_stand_ins(workdir)
+    import Npp
+    Npp.console.quiet = True
+    Npp.notepad.pluginConfigDir = os.path.join(workdir, 'config')
+    os.makedirs(Npp.notepad.pluginConfigDir)
+    cfgdir = Npp.notepad.getPluginConfigDir() + r'\pyscFilteredViewer'     # (the same concatenation the library does)
+    if not os.path.isdir(cfgdir):
+        os.makedirs(cfgdir)
+    with open(cfgdir + r'\pyscFilteredViewer.ini', 'w') as f:
+        f.write(CONFIG.format(python=sys.executable, filter=os.path.join(BENCH, 'filters', 'check_filter.py'), workdir=workdir))
+    import pyscFilteredViewerLibrary as lib
+
+    failed = []
+    try:
+        for name, check in CHECKS:
+            if name not in wanted:
+                continue
+            try:
+                check(lib, workdir)
+            except Exception:
+                failed.append(name)
+                print('FAIL  {}'.format(name))
+                traceback.print_exc()
+            else:
+                print('PASS  {}'.format(name))
+    finally:
+        lib.pyscfv_waitForRenders(30)
+        lib.pyscfv_stopDependencyWatcher()
+        lib.pyscfv_stopFilterServers()
+        if not opts.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,38 @@
+# encoding=utf-8
+"""Filters for the regression checks (bench/check_render.py); the first argument picks what it does:
+    count COUNTFILE SOURCE      appends a line to COUNTFILE (so the check can tell how often it ran), and wraps SOURCE in HTML
+    hang HEARTBEAT              appends to HEARTBEAT every 0.1 s, forever (so the check can tell when it has been stopped)
+    upper                       copies STDIN to STDOUT in upper case (a later pipeline stage)
+    include SOURCE              wraps SOURCE in HTML, followed by the text of inc.txt from the same folder, which it reports as a dependency
+"""
+import sys
+import os
+import time
+
+if os.name == 'nt':
+    import msvcrt
+    msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+    msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+mode = sys.argv[1]
+
+if mode == 'count':
+    with open(sys.argv[2], 'ab') as f:
+        f.write(b'ran\n')
+    with open(sys.argv[3], 'rb') as f:
+        out.write(b'<html><xmp>' + f.read() + b'</xmp></html>\n')
+elif mode == 'hang':
+    while True:
+        with open(sys.argv[2], 'ab') as f:
+            f.write(b'.')
+        time.sleep(0.1)
+elif mode == 'upper':
+    src = getattr(sys.stdin, 'buffer', sys.stdin)
+    for chunk in iter(lambda: src.read(65536), b''):
+        out.write(chunk.upper())
+elif mode == 'include':
+    with open(sys.argv[2], 'rb') as f:
+        text = f.read()
+    with open(os.path.join(os.path.dirname(sys.argv[2]), 'inc.txt'), 'rb') as f:
+        included = f.read()
+    out.write(b'<html><!-- pyscfv-depends: inc.txt --><xmp>' + text + b'</xmp>' + included + b'</html>\n')
@@ -0,0 +1,15 @@
+# encoding=utf-8
+"""Reference filter for the benchmarks: wraps the source (the file named on the command line, or STDIN) in HTML XMP tags"""
+import sys
+import os
+
+if os.name == 'nt':
+    import msvcrt
+    msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+    msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+out.write(b'<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n<xmp>\n')
+src = open(sys.argv[1], 'rb') if len(sys.argv) > 1 else getattr(sys.stdin, 'buffer', sys.stdin)
+for chunk in iter(lambda: src.read(65536), b''):
+    out.write(chunk)
+out.write(b'\n</xmp>\n</html>\n')
@@ -0,0 +1,25 @@
+# encoding=utf-8
+"""This is an example filter plugin for pyscFilteredViewer (a section with Command=python:module:function)
+
+A plugin is a python function which is called inside Notepad++'s PythonScript, without starting a new
+process: it is given the source text (as the same bytes a filter would see on STDIN), and returns the HTML.
+The module is imported the first time it's used, and re-imported whenever the file is changed.
+
+This is just an example, it's not super useful:
+It will just wrap the text of the source with HTML tags, like ExampleConverterCommand.bat does.
+To use it, put something like this in the config file:
+    Command=python:%AppData%\\Notepad++\\plugins\\config\\PythonScript\\scripts\\pyscFilteredViewer\\ExampleFilterPlugin.py:render
+"""
+
+def render(text):
+    """returns the HTML for the source text"""
+    return b''.join([
+        b'<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n',
+        b'<xmp>\n', text, b'\n</xmp>\n</html>\n',
+    ])
+
+# there is nothing to run: pyscFilteredViewer imports this file and calls render() itself
+if __name__ == '__main__':
+    import sys
+    if 'Npp' in sys.modules:
+        sys.modules['Npp'].console.write('ExampleFilterPlugin.py is a filter plugin, used by pyscFilteredViewer; there is nothing to run\n')
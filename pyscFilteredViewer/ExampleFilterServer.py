@@ -0,0 +1,45 @@
+# encoding=utf-8
+"""This is an example filter server for pyscFilteredViewer (a section with Server=1)
+
+It is started once, and then answers one request after another over STDIN/STDOUT:
+    request:    "<length> <source path>\\n" followed by exactly <length> bytes of source text
+    response:   "<length>\\n" followed by exactly <length> bytes of HTML
+It exits when STDIN is closed.
+
+This is just an example, it's not super useful:
+It will just wrap the text of the source with HTML tags, like ExampleConverterCommand.bat does.
+To use it, put something like this in the config file:
+    Command=python "%AppData%\\Notepad++\\plugins\\config\\PythonScript\\scripts\\pyscFilteredViewer\\ExampleFilterServer.py"
+    Server=1
+"""
+import sys
+import os
+
+def serve(stdin, stdout):
+    """answers requests until STDIN is closed"""
+    while True:
+        header = stdin.readline()
+        if not header:
+            break
+        length, _, name = header.decode('utf-8').rstrip('\r\n').partition(' ')
+        text = stdin.read(int(length))
+        html = b''.join([
+            b'<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n',
+            b'<h1>', name.encode('utf-8'), b'</h1>\n',
+            b'<xmp>\n', text, b'\n</xmp>\n</html>\n',
+        ])
+        stdout.write('{}\n'.format(len(html)).encode('ascii'))
+        stdout.write(html)
+        stdout.flush()
+
+# only serve when launched as a filter, not when run from the PythonScript menu inside Notepad++
+#   (from the menu, it would wait forever for requests on Notepad++'s STDIN)
+if __name__ == '__main__' and 'Npp' in sys.modules:
+    sys.modules['Npp'].console.write('ExampleFilterServer.py is a filter server, started by pyscFilteredViewer; there is nothing to run\n')
+elif __name__ == '__main__':
+    if os.name == 'nt':
+        # the protocol counts bytes, so don't let windows translate newlines
+        import msvcrt
+        msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+        msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+    serve(getattr(sys.stdin, 'buffer', sys.stdin), getattr(sys.stdout, 'buffer', sys.stdout))
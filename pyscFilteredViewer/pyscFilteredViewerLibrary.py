@@ -27,31 +27,44 @@ LONG TERM TODO:
     future option: allow destination formats other than HTML   :config(section, 'FilterOutputType')
     future option: allow executing alternate verbs             :config(section, 'ViewerCommand' or 'ViewerVerb')
 """
-from Npp import *
-import ConfigParser
+try:
+    from Npp import *
+except ImportError:
+    from pyscfvHeadless import *        # outside of Notepad++, like pyscfvBatchRender.py from the command line
 import os
-import tempfile
-import subprocess
+import sys
 import string
-from time import sleep
+import re
+import fnmatch
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import sleep, time
 
 ################################################################
 # ekopalypse-style getLexerXxx(), based on
 #   https://notepad-plus-plus.org/community/topic/17134/enhance-udl-lexer
-import ctypes
-import ctypes.wintypes as wintypes
-
-user32 = wintypes.WinDLL('user32')
+#   (ctypes, user32 and the Notepad++ window are only looked up the first time a lexer is asked for, not on import)
 WM_USER = 1024
 NPPMSG = WM_USER + 1000
 NPPM_GETLANGUAGENAME = NPPMSG+83
 NPPM_GETLANGUAGEDESC = NPPMSG+84
-__npp_hwnd = user32.FindWindowW(u'Notepad++', None)
 # console.show()
-# console.write("init: {}\n".format(__npp_hwnd))
+# console.write("init: {}\n".format(__eko_nppWindow()[1]))
 # console.write("\tgld={}\n\tgln={}\n".format( __eko_getLexerDesc(), __eko_getLexerName() ) )
 
-def __eko_getLexerDesc():
+def __eko_nppWindow():
+    """returns (user32, the Notepad++ window handle), loading user32 and finding the window the first time"""
+    if __eko_nppWindow.user32 is None:
+        import ctypes.wintypes as wintypes
+        user32 = wintypes.WinDLL('user32')
+        __eko_nppWindow.hwnd = user32.FindWindowW(u'Notepad++', None)
+        __eko_nppWindow.user32 = user32
+    return __eko_nppWindow.user32, __eko_nppWindow.hwnd
+__eko_nppWindow.user32 = None
+__eko_nppWindow.hwnd = None
+
+def __eko_getLexerDesc(language=None):
     ''' Returns the description text which is shown in the first field of the status bar
 
         Normally one might use notepad.getLanguageDesc(notepad.getLangType())
@@ -62,15 +75,19 @@ def __eko_getLexerDesc():
         original name:      get_lexer_name
         change notes:       eko's get_lexer_name() really used NPPM_GETLANGUAGEDESC,
                             so i call this one __eko_getLexerDesc()
+                            language defaults to the LANGTYPE of the active buffer
         '''
-    language = notepad.getLangType()
-    length = user32.SendMessageW(__npp_hwnd, NPPM_GETLANGUAGEDESC, language, None)
+    import ctypes
+    if language is None:
+        language = notepad.getLangType()
+    user32, npp_hwnd = __eko_nppWindow()
+    length = user32.SendMessageW(npp_hwnd, NPPM_GETLANGUAGEDESC, language, None)
     buffer = ctypes.create_unicode_buffer(u' ' * length)
-    user32.SendMessageW(__npp_hwnd, NPPM_GETLANGUAGEDESC, language, ctypes.byref(buffer))
+    user32.SendMessageW(npp_hwnd, NPPM_GETLANGUAGEDESC, language, ctypes.byref(buffer))
     #console.write(buffer.value+"\n")  # uncomment if unsure how the lexer name in configure should look like - npp restart needed
     return buffer.value
 
-def __eko_getLexerName():
+def __eko_getLexerName(language=None):
     ''' Returns the name of the current lexer
 
         Normally one might use notepad.getLanguageName(notepad.getLangType())
@@ -81,11 +98,15 @@ def __eko_getLexerName():
         original name:      get_lexer_name
         change notes:       eko's get_lexer_name() originally used NPPM_GETLANGUAGEDESC,
                             but I want the NPPM_GETLANGUAGENAME for __eko_getLexerName()
+                            language defaults to the LANGTYPE of the active buffer
         '''
-    language = notepad.getLangType()
-    length = user32.SendMessageW(__npp_hwnd, NPPM_GETLANGUAGENAME, language, None)
+    import ctypes
+    if language is None:
+        language = notepad.getLangType()
+    user32, npp_hwnd = __eko_nppWindow()
+    length = user32.SendMessageW(npp_hwnd, NPPM_GETLANGUAGENAME, language, None)
     buffer = ctypes.create_unicode_buffer(u' ' * length)
-    user32.SendMessageW(__npp_hwnd, NPPM_GETLANGUAGENAME, language, ctypes.byref(buffer))
+    user32.SendMessageW(npp_hwnd, NPPM_GETLANGUAGENAME, language, ctypes.byref(buffer))
     #console.write(buffer.value+"\n")  # uncomment if unsure how the lexer name in configure should look like - npp restart needed
     return buffer.value
 
@@ -123,26 +144,277 @@ def pyscfv_setTrace(flag):
     if __pyscfv_TRACE: console.write('pyscfv_setTrace()\n')
 
 def pyscfv_cleanTempDir():
-    """cleans out the tempdir()/pyscFilteredViewer subdir, creating it if it doesn't already exist"""
+    """cleans out the tempdir()/pyscFilteredViewer subdir, creating it if it doesn't already exist
+
+    This throws away every earlier render; normally, pyscfv_initTempStore() is used instead, which only evicts what's over quota"""
     if __pyscfv_TRACE: console.write('pyscfv_cleanTempDir()\n')
-    folder = os.path.normpath( os.path.join( tempfile.gettempdir(), 'pyscFilteredViewer' ) )
-    if not os.path.exists(folder):
-        os.mkdir(folder)
+    folder = __pyscfv_tempFolder()
     for f in os.listdir(folder):
         full = os.path.normpath( os.path.join( folder, f ) )
         if os.path.isfile( full ):
-            console.write("DEBUG: deleting '{}'\n".format(full))
+            if __pyscfv_DEBUG: console.write("DEBUG: deleting '{}'\n".format(full))
+            os.unlink(full)
+    import shutil
+    shutil.rmtree(os.path.join(folder, 'scope'), ignore_errors=True)     # the scratch copies of scoped renders
+    __pyscfv_publishedDigests.clear()
+    pyscfv_clearRenderCache()
+    with __pyscfv_storeLock:
+        __pyscfv_store['entries'] = {}
+        __pyscfv_store['loaded'] = True
+
+def __pyscfv_tempFolder():
+    """returns the tempdir()/pyscFilteredViewer subdir, creating it if it doesn't already exist"""
+    import tempfile
+    folder = os.path.normpath( os.path.join( tempfile.gettempdir(), 'pyscFilteredViewer' ) )
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    return folder
+
+################################################################
+# temp-folder store:
+#   every file that pyscFilteredViewer puts in tempdir()/pyscFilteredViewer (rendered outputs, render-cache entries,
+#   and the scratch copies of scoped renders)
+#   is recorded in a manifest, along with its size, the last time it was used, and the source file it came from.
+#   When the folder goes over its quota (the TempMaxMB and TempMaxFiles settings), the least-recently-used files
+#   are deleted -- except for the renders of files that are open in Notepad++, which are kept, even across restarts.
+#   Since the manifest knows what's in the folder, startup doesn't need to list and stat the whole folder.  Which files
+#   are open is only asked of Notepad++ when something has to be evicted, so an ordinary save doesn't depend on how many
+#   files are open; and the store updates during a render (pyscfv_storeBatch) only write the manifest once.
+__pyscfv_store = dict(loaded=False, entries={})     # entries: path relative to the folder => [size, lastUsed, source]
+__pyscfv_storeLock = threading.RLock()
+__pyscfv_storeDeferral = threading.local()         # depth (of nested pyscfv_storeBatch blocks) and dirty, for this thread
+__pyscfv_STORE_MANIFEST = 'manifest.json'
+__pyscfv_STORE_MAX_MB = 100
+__pyscfv_STORE_MAX_FILES = 500
+
+def __pyscfv_storeLoad():
+    """loads the manifest the first time the store is used (the caller holds __pyscfv_storeLock)"""
+    if __pyscfv_store['loaded']: return
+    folder = __pyscfv_tempFolder()
+    manifest = os.path.join(folder, __pyscfv_STORE_MANIFEST)
+    entries = None
+    if os.path.exists(manifest):
+        import json
+        try:
+            with open(manifest, 'rb') as f:
+                entries = json.load(f)['entries']
+        except (IOError, ValueError, KeyError) as e:
+            if __pyscfv_DEBUG: console.write('temp store: ignoring unreadable manifest: {}\n'.format(e))
+    if entries is None:
+        # no manifest yet (or it's damaged), so this one time, find out what's in the folder the slow way
+        entries = {}
+        for root, dirs, files in os.walk(folder):
+            for f in files:
+                full = os.path.join(root, f)
+                rel = os.path.relpath(full, folder)
+                if rel != __pyscfv_STORE_MANIFEST:
+                    st = os.stat(full)
+                    entries[rel] = [st.st_size, st.st_mtime, None]
+    __pyscfv_store['entries'] = entries
+    __pyscfv_store['loaded'] = True
+
+    # the first time the store is used in a session, bring the tempdir back within its quota
+    #   (this used to be done when the library was imported, which every helper script paid for, even pyscfvEditConfig)
+    __pyscfv_storeEnforceQuota()
+
+def __pyscfv_storeSave():
+    """writes the manifest (the caller holds __pyscfv_storeLock)"""
+    import json
+    manifest = os.path.join(__pyscfv_tempFolder(), __pyscfv_STORE_MANIFEST)
+    staging = __pyscfv_stagingPath(manifest)
+    with open(staging, 'wb') as f:
+        json.dump(dict(version=1, entries=__pyscfv_store['entries']), f)
+    __pyscfv_replaceFile(staging, manifest)
+
+def __pyscfv_storeChanged():
+    """writes the manifest now, or inside pyscfv_storeBatch(), at the end of the batch (the caller holds __pyscfv_storeLock)"""
+    if getattr(__pyscfv_storeDeferral, 'depth', 0):
+        __pyscfv_storeDeferral.dirty = True
+    else:
+        __pyscfv_storeSave()
+
+@contextmanager
+def pyscfv_storeBatch():
+    """context manager which holds back the manifest writes of this thread's store updates in the block, and writes it once at the end"""
+    depth = getattr(__pyscfv_storeDeferral, 'depth', 0)
+    __pyscfv_storeDeferral.depth = depth + 1
+    try:
+        yield
+    finally:
+        __pyscfv_storeDeferral.depth = depth
+        if not depth and getattr(__pyscfv_storeDeferral, 'dirty', False):
+            __pyscfv_storeDeferral.dirty = False
+            with __pyscfv_storeLock:
+                __pyscfv_storeSave()
+
+def pyscfv_storeTouch(path, source=None):
+    """records that the file at path (in the temp folder) was just written or used, then evicts anything over quota
+
+    source is the file that path was rendered from, if any; renders of files that are open in Notepad++ are never evicted"""
+    if __pyscfv_TRACE: console.write('pyscfv_storeTouch()\n')
+    rel = os.path.relpath(path, __pyscfv_tempFolder())
+    with __pyscfv_storeLock:
+        __pyscfv_storeLoad()
+        previous = __pyscfv_store['entries'].get(rel)
+        if source is None and previous is not None:
+            source = previous[2]
+        __pyscfv_store['entries'][rel] = [os.path.getsize(path), time(), source]
+        __pyscfv_storeEnforceQuota(keep=rel)
+        __pyscfv_storeChanged()
+
+def pyscfv_storeForget(path):
+    """removes path from the store (and deletes the file, if it still exists)"""
+    rel = os.path.relpath(path, __pyscfv_tempFolder())
+    with __pyscfv_storeLock:
+        __pyscfv_storeLoad()
+        __pyscfv_store['entries'].pop(rel, None)
+        __pyscfv_storeChanged()
+    if os.path.exists(path):
+        os.unlink(path)
+
+def pyscfv_storeEnforceQuota():
+    """evicts the least-recently-used files until the temp folder is within the TempMaxMB and TempMaxFiles settings"""
+    with __pyscfv_storeLock:
+        __pyscfv_storeLoad()
+        __pyscfv_storeEnforceQuota()
+        __pyscfv_storeChanged()
+
+def __pyscfv_storeEnforceQuota(keep=None):
+    """does the work for pyscfv_storeEnforceQuota() (the caller holds __pyscfv_storeLock); never evicts the entry named keep"""
+    entries = __pyscfv_store['entries']
+    maxBytes = float(pyscfv_getSetting('TempMaxMB', __pyscfv_STORE_MAX_MB)) * 1024 * 1024
+    maxFiles = int(pyscfv_getSetting('TempMaxFiles', __pyscfv_STORE_MAX_FILES))
+    total = sum( e[0] for e in entries.values() )
+    if total <= maxBytes and len(entries) <= maxFiles:
+        return
+    folder = __pyscfv_tempFolder()
+    opened = set( os.path.normcase(f[0]) for f in notepad.getFiles() )     # (only when something has to go)
+    for rel in sorted( entries, key=lambda r: entries[r][1] ):     # least-recently-used first
+        if total <= maxBytes and len(entries) <= maxFiles:
+            break
+        source = entries[rel][2]
+        if rel == keep or (source is not None and os.path.normcase(source) in opened):
+            continue
+        if __pyscfv_DEBUG: console.write('temp store: evicting "{}"\n'.format(rel))
+        total -= entries.pop(rel)[0]
+        full = os.path.join(folder, rel)
+        if os.path.exists(full):
             os.unlink(full)
 
-class SafeRawConfigParser(ConfigParser.RawConfigParser):
-    """"SafeRawConfigParser will give the 'safe' version of .set() method to the RawConfigParser, without the %-interpolations of ConfigParser or SafeConfigParser"""
-    def set(self, section, option, value):
-        """wrapper around RawConfigParser.set: generate a TypeError if not string or unicode object"""
+def pyscfv_initTempStore():
+    """loads the temp-folder manifest and evicts whatever is over quota, keeping the renders of the files open in Notepad++"""
+    if __pyscfv_TRACE: console.write('pyscfv_initTempStore()\n')
+    pyscfv_storeEnforceQuota()
+
+# /end temp-folder store
+################################################################
+
+################################################################
+# content-addressed render cache:
+#   the key is a hash of (section, resolved command, source content), so a save which
+#   doesn't change the bytes on disk (or re-running the one-shot filter on the same file)
+#   can re-use the previous output rather than spawning the filter again.
+#   The index is kept in memory (bounded, least-recently-used first), and the entries
+#   themselves live on disk in the tempdir()/pyscFilteredViewer/cache subdir.
+#   Renders run on several threads at once (the render queue, batch renders), and OrderedDict isn't thread-safe,
+#   so the index is only used while holding __pyscfv_cacheLock
+__pyscfv_CACHE_MAX_ENTRIES = 64
+__pyscfv_cacheIndex = OrderedDict()     # key => path to cached output
+__pyscfv_cachePublished = {}            # dst_path => key of the render that is currently in dst_path
+__pyscfv_cacheLock = threading.Lock()
+
+def __pyscfv_cacheFolder():
+    """returns the tempdir()/pyscFilteredViewer/cache subdir, creating it if it doesn't already exist"""
+    import tempfile
+    folder = os.path.normpath( os.path.join( tempfile.gettempdir(), 'pyscFilteredViewer', 'cache' ) )
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    return folder
+
+def pyscfv_renderCacheKey(src_fname, command, section, text=None):
+    """returns the cache key for filtering the contents of src_fname with the already-resolved command
+
+    if text is not None, it is the buffer contents being sent to the filter's STDIN, and is hashed instead of src_fname"""
+    import hashlib
+    h = hashlib.sha1()
+    for part in (section or '', command, 'file' if text is None else 'stdin'):
+        h.update('{}:{}\n'.format(len(part), part))
+    if text is not None:
+        h.update(text)
+    else:
+        with open(src_fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+def pyscfv_renderCacheLookup(key):
+    """returns the path to the cached output for key, or None if it's not in the cache"""
+    with __pyscfv_cacheLock:
+        path = __pyscfv_cacheIndex.pop(key, None)
+        if path is None:
+            # not in the in-memory index, but an earlier render this session may still be on disk
+            path = os.path.join( __pyscfv_cacheFolder(), key + '.html' )
+        if not os.path.exists(path):
+            return None
+        __pyscfv_cacheIndex[key] = path     # (re-)insert as most-recently-used
+        __pyscfv_cacheTrim()
+        pyscfv_storeTouch(path)
+        return path
+
+def pyscfv_renderCacheStore(key, rendered_fname):
+    """copies the rendered output into the cache under key"""
+    import shutil
+    path = os.path.join( __pyscfv_cacheFolder(), key + '.html' )
+    with __pyscfv_cacheLock:
+        shutil.copyfile(rendered_fname, path)
+        __pyscfv_cacheIndex.pop(key, None)
+        __pyscfv_cacheIndex[key] = path
+        __pyscfv_cacheTrim()
+        pyscfv_storeTouch(path)
+    return path
+
+def __pyscfv_cacheTrim():
+    """evicts the least-recently-used entries until the index is back within __pyscfv_CACHE_MAX_ENTRIES (the caller holds __pyscfv_cacheLock)"""
+    while len(__pyscfv_cacheIndex) > __pyscfv_CACHE_MAX_ENTRIES:
+        key, path = __pyscfv_cacheIndex.popitem(last=False)
+        if __pyscfv_DEBUG: console.write('render cache: evicting {}\n'.format(key))
+        pyscfv_storeForget(path)
+
+def pyscfv_clearRenderCache():
+    """empties the render cache, both the in-memory index and the entries on disk"""
+    if __pyscfv_TRACE: console.write('pyscfv_clearRenderCache()\n')
+    folder = __pyscfv_cacheFolder()
+    with __pyscfv_cacheLock, pyscfv_storeBatch():
+        __pyscfv_cacheIndex.clear()
+        __pyscfv_cachePublished.clear()
+        for f in os.listdir(folder):
+            full = os.path.join( folder, f )
+            if os.path.isfile( full ):
+                pyscfv_storeForget(full)
+
+# /end content-addressed render cache
+################################################################
+
+__pyscfv_configParserClass = []         # the SafeRawConfigParser class, once SafeRawConfigParser() has defined it
 
-        if type(value) is not str and type(value) is not unicode:
-            raise TypeError('value={} {} is neither a string or unicode string'.format(value, type(value)))
+def SafeRawConfigParser(*args, **kwargs):
+    """returns a new SafeRawConfigParser (the arguments are the same as RawConfigParser's)
 
-        return ConfigParser.RawConfigParser.set(self, section, option, value)
+    ConfigParser is only imported (and the class defined) the first time, so actions that don't read the config don't load it"""
+    if not __pyscfv_configParserClass:
+        import ConfigParser
+
+        class SafeRawConfigParser(ConfigParser.RawConfigParser):
+            """"SafeRawConfigParser will give the 'safe' version of .set() method to the RawConfigParser, without the %-interpolations of ConfigParser or SafeConfigParser"""
+            def set(self, section, option, value):
+                """wrapper around RawConfigParser.set: generate a TypeError if not string or unicode object"""
+
+                if type(value) is not str and type(value) is not unicode:
+                    raise TypeError('value={} {} is neither a string or unicode string'.format(value, type(value)))
+
+                return ConfigParser.RawConfigParser.set(self, section, option, value)
+        __pyscfv_configParserClass.append(SafeRawConfigParser)
+    return __pyscfv_configParserClass[0](*args, **kwargs)
 
 class pyscFilteredViewer_Exception(Exception):
     """Errors in this class are unique to the pyscFilteredViewer"""
@@ -167,37 +439,214 @@ def pyscfv_warningMessage(message, title, doEditConfig=False):
     if doEditConfig:
         pyscfv_EditConfig()
 
-def pyscfv_readFiltersIni():
-    """This reads the PreviewHTML-style filters.ini file, and returns the ConfigParser object"""
+def pyscfv_readFiltersIni(cfgfile=None):
+    """This reads the PreviewHTML-style filters.ini file, and returns the ConfigParser object
+
+    If cfgfile is None, pyscfv_establishConfigFile() is used to find (or create) the file"""
     if __pyscfv_TRACE: console.write('pyscfv_readFilteresIni()\n')
     config = SafeRawConfigParser()    # https://docs.python.org/2/library/configparser.html
-    cfgfile = pyscfv_establishConfigFile()
+    if cfgfile is None:
+        cfgfile = pyscfv_establishConfigFile()
     if __pyscfv_DEBUG: console.write('cfgfile="{}"\n'.format(cfgfile))
     config.read(cfgfile)
 
     return config
 
+################################################################
+# timing statistics:
+#   each stage of the render pipeline is timed, and the most recent timings are kept per config section
+#   (stages that happen before the section is known are kept under '*').  pyscfv_getStats() summarizes them,
+#   pyscfv_showStats() prints that summary to the console, and pyscfv_setStatsLog() (or the StatsLog setting)
+#   also appends every timing to a .csv or .json (one object per line) file
+__pyscfv_stats = {}                     # section => stage => list of the most recent durations, in seconds
+__pyscfv_statsLock = threading.Lock()
+__pyscfv_STATS_SAMPLES = 500
+__pyscfv_statsLogPath = None
+
+@contextmanager
+def pyscfv_timed(stage, section=None):
+    """context manager which records how long its block took, as a timing for stage (and section)"""
+    start = time()
+    try:
+        yield
+    finally:
+        pyscfv_recordTiming(stage, time() - start, section)
+
+def pyscfv_recordTiming(stage, seconds, section=None):
+    """records one timing for the stage of the pipeline, for the given config section"""
+    section = section or '*'
+    with __pyscfv_statsLock:
+        samples = __pyscfv_stats.setdefault(section, {}).setdefault(stage, [])
+        samples.append(seconds)
+        if len(samples) > __pyscfv_STATS_SAMPLES:
+            del samples[0]
+    logPath = __pyscfv_statsLogPath or pyscfv_getSetting('StatsLog')
+    if logPath:
+        __pyscfv_logTiming(os.path.expandvars(logPath), stage, seconds, section)
+
+def __pyscfv_logTiming(logPath, stage, seconds, section):
+    """appends one timing to the stats log: .json files get one JSON object per line, anything else gets CSV"""
+    stamp = time()
+    with __pyscfv_statsLock:
+        isNew = not os.path.exists(logPath)
+        with open(logPath, 'ab') as f:
+            if logPath.lower().endswith('.json'):
+                import json
+                f.write(json.dumps(dict(time=stamp, section=section, stage=stage, seconds=seconds)) + '\n')
+            else:
+                if isNew: f.write('time,section,stage,seconds\n')
+                f.write('{:.3f},"{}",{},{:.6f}\n'.format(stamp, section.replace('"', '""'), stage, seconds))
+
+def pyscfv_setStatsLog(path):
+    """sets the file that every timing is appended to (overriding the StatsLog setting); None turns it back to the setting"""
+    global __pyscfv_statsLogPath
+    __pyscfv_statsLogPath = path
+
+def pyscfv_getStats(section=None):
+    """returns the timing summary as { section: { stage: dict(count, total, p50, p95, max) } }, with times in seconds
+
+    If section is given, only that section's { stage: summary } is returned"""
+    with __pyscfv_statsLock:
+        raw = { s: { stage: sorted(samples) for stage, samples in stages.items() } for s, stages in __pyscfv_stats.items() }
+    stats = {}
+    for s, stages in raw.items():
+        stats[s] = {}
+        for stage, samples in stages.items():
+            stats[s][stage] = dict(
+                count = len(samples),
+                total = sum(samples),
+                p50 = __pyscfv_percentile(samples, 50),
+                p95 = __pyscfv_percentile(samples, 95),
+                max = samples[-1],
+            )
+    if section is not None:
+        return stats.get(section, {})
+    return stats
+
+def __pyscfv_percentile(ordered, pct):
+    """nearest-rank percentile of an already-sorted, non-empty list"""
+    rank = int(-(-len(ordered) * pct // 100))     # ceiling
+    return ordered[max(rank, 1) - 1]
+
+def pyscfv_resetStats():
+    """forgets all the timings"""
+    with __pyscfv_statsLock:
+        __pyscfv_stats.clear()
+
+def pyscfv_showStats():
+    """prints the timing summary to the PythonScript console"""
+    console.show()
+    console.write('{:<20} {:<18} {:>6} {:>10} {:>10} {:>10}\n'.format('section', 'stage', 'count', 'p50 ms', 'p95 ms', 'max ms'))
+    stats = pyscfv_getStats()
+    for section in sorted(stats):
+        for stage in sorted(stats[section]):
+            s = stats[section][stage]
+            console.write('{:<20} {:<18} {:>6} {:>10.1f} {:>10.1f} {:>10.1f}\n'.format(section, stage, s['count'], s['p50']*1000, s['p95']*1000, s['max']*1000))
+
+# /end timing statistics
+################################################################
+
+################################################################
+# config cache:
+#   the parsed config is kept between runs, and the ini file is only re-read and re-parsed when
+#   its modification time or size changes, so one-shot runs skip the parsing entirely,
+#   and a registered FilterOnSave picks up edits to the config file on the next save;
+#   every re-parse gets the next generation number, which the per-buffer section memo is keyed on
+__pyscfv_configCache = dict(cfgfile=None, stamp=None, configDict=None, generation=0)
+__pyscfv_configLock = threading.Lock()
+
+def pyscfv_getConfigDict():
+    """returns the pyscfv_parseConfig() dictionary for the config file, re-parsing only if the file has changed"""
+    if __pyscfv_TRACE: console.write('pyscfv_getConfigDict()\n')
+    with __pyscfv_configLock:
+        cache = __pyscfv_configCache
+        st = None
+        if cache['cfgfile'] is not None:
+            try:
+                st = os.stat(cache['cfgfile'])
+            except OSError:
+                pass    # it went away: go through pyscfv_establishConfigFile() again, below
+        if st is None:
+            with pyscfv_timed('config-establish'):
+                cache['cfgfile'] = pyscfv_establishConfigFile()
+            st = os.stat(cache['cfgfile'])
+
+        stamp = (st.st_mtime, st.st_size)
+        if cache['configDict'] is None or cache['stamp'] != stamp:
+            if __pyscfv_DEBUG: console.write('config cache: (re-)reading "{}"\n'.format(cache['cfgfile']))
+            with pyscfv_timed('config-read'):
+                configObj = pyscfv_readFiltersIni(cache['cfgfile'])
+            with pyscfv_timed('config-parse'):
+                cache['configDict'] = pyscfv_parseConfig(configObj)
+            cache['stamp'] = stamp
+            cache['generation'] += 1
+            cache['configDict']['generation'] = cache['generation']
+            global __pyscfv_settings
+            __pyscfv_settings = cache['configDict']['settings']
+        return cache['configDict']
+
+def pyscfv_setConfigFile(cfgfile):
+    """uses cfgfile as the config file from now on, instead of the one pyscfv_establishConfigFile() finds"""
+    if __pyscfv_TRACE: console.write('pyscfv_setConfigFile()\n')
+    with __pyscfv_configLock:
+        __pyscfv_configCache.update(cfgfile=os.path.abspath(cfgfile), stamp=None, configDict=None)
+
+def pyscfv_reloadConfig():
+    """forgets the cached config, so the next pyscfv_getConfigDict() re-establishes and re-reads the config file"""
+    if __pyscfv_TRACE: console.write('pyscfv_reloadConfig()\n')
+    with __pyscfv_configLock:
+        __pyscfv_configCache.update(cfgfile=None, stamp=None, configDict=None)
+
+# /end config cache
+################################################################
+
 def pyscfv_parseConfig(config):
     """This takes the ConfigParser object and extracts the data into a dictionary
 
-    Also might make a reverse map for extensions and for languages
+    Also makes a reverse map for extensions and for languages,
+    and compiles them (plus any Pattern= globs or Regex= regular expressions) into the 'matchers' index
+    used by pyscfv_matchSection()
     """
     if __pyscfv_TRACE: console.write('pyscfv_parseConfig()\n')
 
-    deep = dict(config=None, languages={}, extensions={})
+    deep = dict(config=None, languages={}, extensions={}, matchers=None, settings={}, generation=None)
+
+    # the [pyscFilteredViewer] section holds the global settings, rather than a filter
+    sections = [ s for s in config.sections() if s != __pyscfv_SETTINGS_SECTION ]
+    if config.has_section(__pyscfv_SETTINGS_SECTION):
+        deep['settings'] = dict(config.items(__pyscfv_SETTINGS_SECTION))
 
-    deep['config'] = { s:dict(config.items(s)) for s in config.sections() }       # https://stackoverflow.com/a/28990982/5508606
+    deep['config'] = { s:dict(config.items(s)) for s in sections }       # https://stackoverflow.com/a/28990982/5508606
 
+    # the matchers are checked in priority order: languages, then extensions (longest first), then globs, then regexes;
+    # within the same priority, the section that comes first in the config file wins
+    matchers = dict(languages={}, suffixes=[], globs=[], regexes=[])
 
     ext_sections  = {}  # dictionary of extension => section pairs
-    for s in config.sections():
-        lang = config.get(s, 'language')
-        deep['languages'][lang] = s
-        x = config.get(s, 'extension')
+    for s in sections:
+        if config.has_option(s, 'language'):
+            lang = config.get(s, 'language')
+            deep['languages'][lang] = s
+            matchers['languages'].setdefault(lang.lower(), s)
+        x = config.get(s, 'extension') if config.has_option(s, 'extension') else ''
         for ext in x.split():           # split on whitespace
             deep['extensions'][ext] = s
             # I had tried replacing this `for ext` loop with `deep['extensions'] = { ext:s for ext in x.split() }`,
             # but that overwrites deep['extensions'] with every section, so I only got the last section's-worth
+            if __pyscfv_isGlob(ext):
+                matchers['globs'].append( (re.compile(fnmatch.translate(ext), re.IGNORECASE), s) )
+            else:
+                matchers['suffixes'].append( (ext.lower(), s) )
+        if config.has_option(s, 'pattern'):
+            for glob in config.get(s, 'pattern').split():
+                matchers['globs'].append( (re.compile(fnmatch.translate(glob), re.IGNORECASE), s) )
+        if config.has_option(s, 'regex'):
+            try:
+                matchers['regexes'].append( (re.compile(config.get(s, 'regex'), re.IGNORECASE), s) )
+            except re.error as e:
+                pyscfv_warningMessage('[{}] Regex={}\n\nis not a valid regular expression: {}'.format(s, config.get(s, 'regex'), e), 'pyscFilteredViewer: bad Regex in config', True)
+    matchers['suffixes'].sort(key=lambda pair: -len(pair[0]))   # sort is stable, so config order is kept for equal lengths
+    deep['matchers'] = matchers
 
     if __pyscfv_DEBUG:
         console.write('config     = {}\n'.format(deep['config']))
@@ -207,28 +656,91 @@ def pyscfv_parseConfig(config):
 
     return deep
 
+__pyscfv_SETTINGS_SECTION = 'pyscFilteredViewer'
+__pyscfv_settings = {}          # the global settings from the most recent pyscfv_getConfigDict()
+
+def pyscfv_getSetting(option, default=None):
+    """returns the value of option from the [pyscFilteredViewer] settings section of the config file, or default if it's not set"""
+    return __pyscfv_settings.get(option.lower(), default)
+
+def __pyscfv_isGlob(pattern):
+    """true if the Extension= entry has glob wildcards, rather than being a plain extension like .md or .md.txt"""
+    return any(c in pattern for c in '*?[')
+
+def pyscfv_matchSection(cfgDict, fileName, fileLangName=None):
+    """returns the config section for the given filename and Notepad++ language name, or None if no section matches
+
+    All the comparisons are case-insensitive.  Priority is
+        1. Language=
+        2. Extension= -- the longest matching extension wins, so .md.txt beats .txt
+        3. Extension= entries with wildcards (like README*), and Pattern= globs, in config-file order;
+           these are matched against the file's basename, unless the glob has a path separator in it
+        4. Regex=, in config-file order; this is searched for in the full path
+    """
+    matchers = cfgDict['matchers']
+    if fileLangName is not None and fileLangName.lower() in matchers['languages']:
+        return matchers['languages'][fileLangName.lower()]
+
+    baseName = os.path.basename(fileName).lower()
+    for suffix, section in matchers['suffixes']:
+        if baseName.endswith(suffix):
+            return section
+
+    for glob, section in matchers['globs']:
+        if glob.match(baseName) or glob.match(fileName):
+            return section
+
+    for regex, section in matchers['regexes']:
+        if regex.search(fileName):
+            return section
+
+    return None
+
 def pyscfv_pickSectionBasedOnActiveFile(cfgDict, edit_config_on_fail = False):
-    """pick the appropriate configuration section, based on the cfgDict's reverse-maps, and the currently-active file in Notepad++"""
+    """pick the appropriate configuration section, based on the cfgDict's reverse-maps, and the currently-active file in Notepad++
+
+    The chosen section is memoized in the buffer's session, until the buffer's language or filename changes (or the config is re-read)"""
     if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_pickSectionBasedOnActiveFile()\n')
+    return pyscfv_pickSectionForBuffer(cfgDict, None, edit_config_on_fail)
+
+def pyscfv_pickSectionForBuffer(cfgDict, bufferID=None, edit_config_on_fail = False):
+    """pick the appropriate configuration section for the given buffer (which need not be the active one; None means the active one)"""
+    start = time()
+    section = __pyscfv_pickSectionForBuffer(cfgDict, bufferID, edit_config_on_fail)
+    pyscfv_recordTiming('section-pick', time() - start, section)
+    return section
+
+def __pyscfv_pickSectionForBuffer(cfgDict, bufferID, edit_config_on_fail):
+    """does the work for pyscfv_pickSectionForBuffer()"""
     # this is basically MakeChoiceBasedOnLanguage.py
-    fileName = notepad.getCurrentFilename()                 # filename of the current buffer
-    fileLangEnum = notepad.getCurrentLang()                 # gets the LANGTYPE enum for the current buffer: is there a difference between .getCurrentLang() and .getLangType()? Not that I can find
+    if bufferID is None:
+        bufferID = notepad.getCurrentBufferID()
+        fileName = notepad.getCurrentFilename()             # filename of the current buffer
+        fileLangEnum = notepad.getCurrentLang()             # gets the LANGTYPE enum for the current buffer: is there a difference between .getCurrentLang() and .getLangType()? Not that I can find
+    else:
+        fileName = notepad.getBufferFilename(bufferID)
+        fileLangEnum = notepad.getLangType(bufferID)
+
+    # re-use the section from last time, if nothing relevant has changed
+    # (a config dict that didn't come from pyscfv_getConfigDict() has no generation, so it isn't memoized)
+    session = pyscfv_getSession(bufferID)
+    memoKey = (cfgDict.get('generation'), fileName, fileLangEnum)
+    if memoKey[0] is not None and session['memoKey'] == memoKey:
+        if __pyscfv_DEBUG: console.write('\tmemoized section = "{}"\n'.format( session['section'] ))
+        return session['section']
     #fileLangName = notepad.getLanguageName(fileLangEnum)    # converts LANGTYPE to the official string for the selected language
-    fileLangName = __eko_getLexerName()                     # alternate way to convert LANGTYPE to official string for the selected language
+    with pyscfv_timed('lexer-query'):
+        fileLangName = __pyscfv_sessionLanguage(session, fileLangEnum)     # alternate way to convert LANGTYPE to official string for the selected language
     if __pyscfv_DEBUG: console.write('\tfile = "{}"\n\tlanguage = "{}"\n\tlanguage name = "{}"\n'.format( fileName, fileLangEnum, fileLangName ))
-    if fileLangEnum is LANGTYPE.USER:                       # UDL will have fileLangName = "udf - UdlLanguageName"
-        fileLangName = (fileLangName.split(' - '))[1]       # grab the specific UdlLanguageName
-        if __pyscfv_DEBUG: console.write('\tUDL = "{}"\n'.format( fileLangName ) )
 
-    if fileLangName in cfgDict['languages']:
-        return cfgDict['languages'][fileLangName]           # this is the section for the active file
+    # match on language first, and then resort to extension (or glob/regex) parsing
+    section = pyscfv_matchSection(cfgDict, fileName, fileLangName)
+    if section is not None:
+        session.update(memoKey=memoKey, section=section)
+        return section                                      # this is the section for the active file
 
-    # since a matching filter wasn't found based on the file's language,
-    # resort to extension parsing:
     fileExt  = (os.path.splitext(fileName))[1]              # the 1th element should be the extension, if there is one
     if __pyscfv_DEBUG: console.write('\tfilename extension = "{}"\n'.format( fileExt ) )
-    if fileExt in cfgDict['extensions']:
-        return cfgDict['extensions'][fileExt]               # this is the section for the active file
 
     errtitle = 'pyscFilteredViewer: no config found'
     errmsg = 'Could not find an appropriate configuration section for' + '\n\n'
@@ -245,6 +757,74 @@ def pyscfv_pickSectionBasedOnActiveFile(cfgDict, edit_config_on_fail = False):
         __pyscfv_MESSAGE = errmsg + '\n\n' + 'Running the pyscfvEditConfig script will open the config file for you'
     return
 
+################################################################
+# per-buffer sessions:
+#   everything that's worth remembering about a buffer between saves and tab switches, so that saving or switching
+#   tabs doesn't have to work it out again (or ask Notepad++ for it through Win32 messages):
+#       memoKey, section    the section picked for the buffer, and the (config generation, fileName, LANGTYPE) it was picked for
+#       output, launched    the buffer's filtered file, and whether its viewer has been launched (for FilterOnSave)
+#       lexer               (LANGTYPE, lexer name, lexer description), from the __eko_ functions
+#   A session is forgotten when its buffer is closed; its section and lexer are forgotten when the buffer's language
+#   changes or it's renamed (every UDL has the same LANGTYPE.USER, so switching from one UDL to another can only be
+#   noticed with LANGCHANGED).
+__pyscfv_sessions = {}                  # bufferID => session dict
+__pyscfv_sessionsLock = threading.Lock()
+
+def pyscfv_getSession(bufferID):
+    """returns the session dict for bufferID, starting a new one if needed"""
+    with __pyscfv_sessionsLock:
+        session = __pyscfv_sessions.get(bufferID)
+        if session is None:
+            session = __pyscfv_sessions[bufferID] = dict(bufferID=bufferID, memoKey=None, section=None, output=None, launched=False, lexer=None)
+            __pyscfv_registerSessionCallbacks()
+        return session
+
+def pyscfv_forgetSessions(launchOnly=False):
+    """forgets every session; or, with launchOnly, just which viewers have been launched (so they'll be launched again)"""
+    with __pyscfv_sessionsLock:
+        if not launchOnly:
+            __pyscfv_sessions.clear()
+        for session in __pyscfv_sessions.values():
+            session.update(output=None, launched=False)
+
+def __pyscfv_sessionLexer(session, langEnum):
+    """returns (lexer name, lexer description) for the session's buffer, only asking Notepad++ when its language has changed"""
+    lexer = session['lexer']
+    if lexer is None or lexer[0] != langEnum:
+        lexer = session['lexer'] = (langEnum, __eko_getLexerName(langEnum), __eko_getLexerDesc(langEnum))
+    return lexer[1], lexer[2]
+
+def __pyscfv_sessionLanguage(session, langEnum):
+    """returns the language name to match against Language= for the session's buffer: the lexer name, or the UDL's own name"""
+    fileLangName = __pyscfv_sessionLexer(session, langEnum)[0]
+    if langEnum is LANGTYPE.USER and ' - ' in fileLangName:     # UDL will have fileLangName = "udf - UdlLanguageName"
+        fileLangName = (fileLangName.split(' - '))[1]           # grab the specific UdlLanguageName
+    return fileLangName
+
+def __pyscfv_registerSessionCallbacks():
+    """the first time a session is started, hook the notifications that invalidate sessions"""
+    if __pyscfv_registerSessionCallbacks.registered: return
+    notepad.callback(pyscfv_Callback_InvalidateSession, [NOTIFICATION.LANGCHANGED, NOTIFICATION.FILERENAMED])
+    notepad.callback(pyscfv_Callback_ForgetSession, [NOTIFICATION.FILECLOSED])
+    __pyscfv_registerSessionCallbacks.registered = True
+__pyscfv_registerSessionCallbacks.registered = False
+
+def pyscfv_Callback_InvalidateSession(kwargs):
+    """This callback forgets the section and lexer for a buffer whose language changed, or which was renamed"""
+    with __pyscfv_sessionsLock:
+        session = __pyscfv_sessions.get(kwargs.get('bufferID'))
+        if session is not None:
+            session.update(memoKey=None, section=None, lexer=None)
+
+def pyscfv_Callback_ForgetSession(kwargs):
+    """This callback forgets the whole session for a buffer which was closed"""
+    with __pyscfv_sessionsLock:
+        __pyscfv_sessions.pop(kwargs.get('bufferID'), None)
+    pyscfv_forgetDependencies(kwargs.get('bufferID'))
+
+# /end per-buffer sessions
+################################################################
+
 def pyscfv_errorCheckSection(cDict, section):
     """Error checks "section"; if it does not have a 'command' setting, generate a warning and return None"""
     if __pyscfv_TRACE: console.write('pyscfv_errorCheckSection()\n')
@@ -278,6 +858,7 @@ def pyscfv_diplayFilteredOutput(cDict, section, ext='html', skipLaunch=False):
 
     # ensure there is a selected section
     if section is None:
+        global __pyscfv_MESSAGE
         tempFile = __pyscfv_message_as_html(__pyscfv_MESSAGE, 'editConfig')
         pyscfv_launch_default_app(tempFile)
         __pyscfv_MESSAGE = '' # clear the message
@@ -289,17 +870,195 @@ def pyscfv_diplayFilteredOutput(cDict, section, ext='html', skipLaunch=False):
         return  # already gave the warning, so don't need to raise another exception
 
     # 1 filter the source file to a temporary file
-    sourceFile = notepad.getCurrentFilename()                 # filename of the current buffer
-    tempFile = pyscfv_filter_file( cDict['config'][section]['command'], sourceFile )
+    #   (with Progressive=1, the viewer is launched on the first partial output, rather than waiting for the filter to finish)
+    options = cDict['config'][section]
+    launched = []
+    def progress(tmpfile):
+        if not launched:
+            if not skipLaunch: pyscfv_launch_viewer(tmpfile, options, section)
+            launched.append(tmpfile)
+        elif __pyscfv_isHttpViewer(options):
+            pyscfv_previewPublish(tmpfile)
+    command, sourceFile, sourceText, encoding = __pyscfv_filterInputs(cDict, section)
+    tempFile = pyscfv_filter_file( command, sourceFile, section, sourceText, options=options, onProgress=progress, encoding=encoding )
 
     # 2 launch default viewer for the temporary file
-    if not skipLaunch: pyscfv_launch_default_app(tempFile)
+    if launched:
+        if __pyscfv_isHttpViewer(options): pyscfv_previewPublish(tempFile)
+    elif not skipLaunch: pyscfv_launch_viewer(tempFile, options, section)
 
     # 3 return filename so it can be deleted later
     return tempFile
 
+def __pyscfv_filterInputs(cDict, section, bufferID=None):
+    """grabs everything the filter needs from the active buffer: returns (command, sourceFile, sourceText, encoding)
+
+    This needs to run in the Notepad++ thread, so the results can be handed off to a background render.
+    encoding is the buffer's encoding, for %{encoding} (see __pyscfv_bufferEncoding).
+    With Input=stdin, sourceText is the live buffer text, which is sent to the filter instead of the file on disk;
+    otherwise, sourceText is None.  With Scope=, only part of the buffer is filtered (see pyscfv_scopedText):
+    that part is the sourceText (with Input=file too, in which case pyscfv_filter_file() saves it to a scratch copy for %1).
+
+    If bufferID is some other buffer than the active one (like the buffers saved by Save All), it has just been
+    saved, so its file is used (and Scope= doesn't apply, since it's about the caret in the active buffer)"""
+    options = cDict['config'][section]
+    stdin = options.get('input', 'file').strip().lower() == 'stdin'
+    if bufferID is not None and bufferID != notepad.getCurrentBufferID():
+        sourceFile = notepad.getBufferFilename(bufferID)
+        sourceText = None
+        if stdin:
+            with open(sourceFile, 'rb') as f:
+                sourceText = f.read()
+        return options['command'], sourceFile, sourceText, __pyscfv_bufferEncoding(bufferID)
+    sourceFile = notepad.getCurrentFilename()                 # filename of the current buffer
+    sourceText = None
+    scoped = pyscfv_scopedText(options)
+    if scoped is not None:
+        sourceText = scoped
+    elif stdin:
+        sourceText = editor.getText()
+    return options['command'], sourceFile, sourceText, __pyscfv_bufferEncoding()
+
+################################################################
+# scoped rendering:
+#   for a very large file, filtering the whole thing on every save gets slower as the file grows.  With Scope=selection,
+#   only the selected text is filtered (or, if nothing is selected, the lines around the caret); with Scope=caret, it's
+#   always the ScopeLines= lines (default 100) above and below the caret.  Preamble=N puts the first N lines of the file
+#   (the document's header, front matter, or macro definitions) in front of the scoped text, so it still filters right.
+__pyscfv_SCOPE_LINES = 100
+
+def pyscfv_scopedText(options):
+    """returns the part of the active buffer that the section's Scope= setting selects, or None if the section isn't scoped"""
+    scope = options.get('scope', '').strip().lower()
+    if scope not in ('selection', 'caret'):
+        return None
+    preambleLines = int(options.get('preamble', '0').strip() or 0)
+    if scope == 'selection' and not editor.getSelectionEmpty():
+        start, end = editor.getSelectionStart(), editor.getSelectionEnd()
+    else:
+        window = int(options.get('scopelines', '').strip() or __pyscfv_SCOPE_LINES)
+        caretLine = editor.lineFromPosition(editor.getCurrentPos())
+        lastLine = editor.getLineCount() - 1
+        start = editor.positionFromLine( max(0, caretLine - window) )
+        end = editor.positionFromLine(caretLine + window + 1) if caretLine + window < lastLine else editor.getLength()
+    preamble = ''
+    if preambleLines > 0:
+        preambleEnd = editor.positionFromLine(preambleLines) if preambleLines < editor.getLineCount() else editor.getLength()
+        if start <= preambleEnd:
+            start = 0                                       # the scope already reaches the preamble, so just extend it to the top
+        else:
+            preamble = editor.getTextRange(0, preambleEnd)
+    if __pyscfv_DEBUG: console.write('scope={}: filtering positions {}..{} (plus {} bytes of preamble)\n'.format(scope, start, end, len(preamble)))
+    return preamble + editor.getTextRange(start, end)
+
+def __pyscfv_scopeFilePath(sourceFile):
+    """the scratch file for the scoped text of sourceFile: it has the same name (so %1 has the right extension), in a folder of its own"""
+    import zlib
+    import tempfile
+    folder = os.path.normpath( os.path.join( tempfile.gettempdir(), 'pyscFilteredViewer', 'scope', '{:08X}'.format(zlib.crc32(sourceFile) & 0xFFFFFFFF) ) )
+    return os.path.join(folder, os.path.basename(sourceFile))
+
+def __pyscfv_writeScopeFile(scratch, text, sourceFile):
+    """saves the scoped text of sourceFile to the scratch file (from __pyscfv_scopeFilePath), and records it in the temp store"""
+    if not os.path.exists(os.path.dirname(scratch)):
+        os.makedirs(os.path.dirname(scratch))
+    with open(scratch, 'wb') as f:
+        f.write(text)
+    pyscfv_storeTouch(scratch, sourceFile)
+
+# /end scoped rendering
+################################################################
+
+################################################################
+# render tiers:
+#   a section can have a FastCommand= as well as its Command=: FilterOnSave runs the fast one on every save, for a quick
+#   (if rough) preview, and the full Command= once the buffer has been idle -- not saved again -- for IdleDelay= seconds
+#   (default 2; a negative IdleDelay never runs it in the background, so it's only run on demand, by pyscFilteredViewer).
+#   With Budget= (seconds), FilterOnSave runs the full command on every save for as long as its recent runtimes fit the
+#   budget, and only falls back to the fast one (and the idle full render) once they don't.  Either command is followed
+#   by the Command2=, Command3=, ... stages, if there are any.
+__pyscfv_tierHistory = {}               # (section, command) => list of the most recent runtimes, in seconds
+__pyscfv_tierLock = threading.Lock()
+__pyscfv_TIER_SAMPLES = 5
+__pyscfv_IDLE_DELAY = 2.0
+__pyscfv_idleTimers = {}                # bufferID => threading.Timer for the buffer's pending full render
+
+def pyscfv_recordCommandRuntime(section, cmd, seconds):
+    """records how long one run of cmd took for section, for pyscfv_expectedRuntime()"""
+    with __pyscfv_tierLock:
+        samples = __pyscfv_tierHistory.setdefault((section, cmd), [])
+        samples.append(seconds)
+        if len(samples) > __pyscfv_TIER_SAMPLES:
+            del samples[0]
+
+def pyscfv_expectedRuntime(section, cmd):
+    """the median of the most recent runtimes of cmd for section, or None if it hasn't been run yet"""
+    with __pyscfv_tierLock:
+        samples = sorted(__pyscfv_tierHistory.get((section, cmd), []))
+    if not samples:
+        return None
+    return __pyscfv_percentile(samples, 50)
+
+def pyscfv_chooseTier(options, section):
+    """returns (command, fast) for an on-save render of section: fast is True when it's the FastCommand="""
+    full = options['command']
+    fast = options.get('fastcommand', '').strip()
+    if not fast:
+        return full, False
+    budget = options.get('budget', '').strip()
+    if budget:
+        expected = pyscfv_expectedRuntime(section, full)
+        if __pyscfv_DEBUG: console.write('tier: full command is expected to take {} s, budget is {} s\n'.format(expected, budget))
+        if expected is None or expected <= float(budget):
+            return full, False
+    return fast, True
+
+def pyscfv_scheduleFullRender(bufferID, cmd, src_fname, section, text, onDone, options, encoding=None):
+    """after a fast on-save render, schedules the full render of the buffer for when it has been idle for IdleDelay= seconds"""
+    delay = float(options.get('idledelay', '').strip() or __pyscfv_IDLE_DELAY)
+    if delay < 0:
+        return
+    timer = threading.Timer(delay, __pyscfv_idleFullRender, args=(bufferID, cmd, src_fname, section, text, onDone, options, encoding))
+    timer.daemon = True
+    with __pyscfv_tierLock:
+        __pyscfv_idleTimers[bufferID] = timer
+    timer.start()
+
+def pyscfv_cancelFullRender(bufferID=None):
+    """cancels the scheduled full render of the buffer (or, if bufferID is None, of every buffer)"""
+    with __pyscfv_tierLock:
+        if bufferID is None:
+            timers = list(__pyscfv_idleTimers.values())
+            __pyscfv_idleTimers.clear()
+        else:
+            timers = [ t for t in [ __pyscfv_idleTimers.pop(bufferID, None) ] if t is not None ]
+    for timer in timers:
+        timer.cancel()
+
+def __pyscfv_idleFullRender(bufferID, cmd, src_fname, section, text, onDone, options, encoding):
+    """body of the idle timer: queues the full render, unless the buffer's fast render is still going (then it waits some more)"""
+    with __pyscfv_tierLock:
+        if __pyscfv_idleTimers.get(bufferID) is not threading.current_thread():
+            return                              # cancelled, or replaced by a newer save
+        del __pyscfv_idleTimers[bufferID]
+    with __pyscfv_renderLock:
+        busy = bufferID in __pyscfv_renderJobs
+    if busy:
+        pyscfv_scheduleFullRender(bufferID, cmd, src_fname, section, text, onDone, options, encoding)
+        return
+    if __pyscfv_DEBUG: console.write('idle: full render of "{}"\n'.format(src_fname))
+    pyscfv_submitRender(bufferID, cmd, src_fname, section, text, onDone, options, onDone, encoding=encoding)
+
+# /end render tiers
+################################################################
+
+def __pyscfv_isTrue(value):
+    """interprets a config-file value (like Server=1 or Server=yes) as a boolean"""
+    return str(value).strip().lower() in ('1', 'yes', 'true', 'on')
+
 def __pyscfv_message_as_html(msg, src_fname):
     """Outputs the message to a named temporary file"""
+    import tempfile
     if __pyscfv_TRACE: console.write('pyscfv_filter_file()\n')
 
     dst_path = os.path.normpath( os.path.join( tempfile.gettempdir(), 'pyscFilteredViewer', '.'.join(('{:08X}'.format(0xFFFFFFFF), os.path.basename(src_fname), 'FILTERED', 'html')) ) )
@@ -307,15 +1066,43 @@ def __pyscfv_message_as_html(msg, src_fname):
     if not os.path.exists(parent):
         os.mkdir(parent)
 
-    f = open(dst_path, mode='wt')
+    f = open(__pyscfv_stagingPath(dst_path), mode='wt')
     f.writelines(['<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n<xmp>\n',msg,'</xmp>\n</html>'])
     f.close()
-    if __pyscfv_DEBUG: console.write('"{}": file = {} bytes\n'.format(f.name, os.path.getsize(f.name)))
+    pyscfv_publishOutput(f.name, dst_path)
+    pyscfv_storeTouch(dst_path)
+    if __pyscfv_DEBUG: console.write('"{}": file = {} bytes\n'.format(dst_path, os.path.getsize(dst_path)))
+
+    return dst_path
 
-    return f.name
+def pyscfv_filter_file(cmd, src_fname, section=None, text=None, job=None, options=None, onProgress=None, encoding=None):
+    """run the filter command on the given file
 
-def pyscfv_filter_file(cmd, src_fname):
-    """run the filter command on the given file"""
+    If text is not None, it is streamed to the filter's STDIN (and src_fname is only used for %1
+    and for naming the output), so the filter sees the unsaved buffer rather than the file on disk.
+    But if the section has Scope= without Input=stdin, text is the scoped part of the buffer, which is saved
+    to a scratch copy for the filter to read instead: only %1 names the scratch copy, while the output name,
+    the other placeholders (like %{dir}), and the dependencies still go by src_fname.
+
+    If job is not None, it is the background render job (from pyscfv_submitRender) this filter run
+    belongs to, so the filter process can be killed if the job is cancelled.
+
+    options is the dictionary of config-file settings for the section (if any): with Server=1,
+    cmd is a long-lived filter server (see pyscfv_serve_file) rather than a one-shot filter; with
+    Command2=, Command3=, ..., the output of cmd is piped through those further stages (see pyscfv_pipelineStages).
+    If cmd is python:module:function, it is an in-process filter plugin (see pyscfv_run_plugin) rather than a command.
+    With Progressive=1, partial output is published while the filter is still running, and onProgress(dst_path)
+    is called (from another thread) after each partial publish; see __pyscfv_pumpOutput().
+
+    encoding is the source buffer's encoding, for %{encoding}, as __pyscfv_filterInputs() read it on the Notepad++ thread.
+
+    If the same command has already been run on the same file contents (for the same section),
+    the output is re-used from the render cache instead of running the filter again.
+
+    The filter writes to a staging file next to the output, which is only moved into place (atomically)
+    once the filter is done, so a viewer never sees a half-written file; see pyscfv_publishOutput()"""
+    import subprocess
+    import tempfile
     if __pyscfv_TRACE: console.write('pyscfv_filter_file()\n')
 
     import zlib
@@ -329,20 +1116,1357 @@ def pyscfv_filter_file(cmd, src_fname):
     if not os.path.exists(parent):
         os.mkdir(parent)
 
-    f = open(dst_path, mode='wt')
+    # a scoped render without Input=stdin gets the scoped text in a scratch copy of the source, which only %1 names
+    input_fname, stdin = src_fname, text
+    if text is not None and options is not None and options.get('input', 'file').strip().lower() != 'stdin':
+        input_fname, stdin = __pyscfv_scopeFilePath(src_fname), None
+
+    # expand %1 (and the other placeholders) into the command's argument list; see pyscfv_expandCommand()
+    #   (a filter server is shared by all files, so it gets the source file name with each request instead)
+    server = options is not None and __pyscfv_isTrue(options.get('server', ''))
+    plugin = pyscfv_isPluginCommand(cmd)
+    if plugin:
+        command = cmd + '\n' + repr(__pyscfv_pluginStamp(cmd))     # only used for the cache key: a changed plugin re-renders
+    elif server:
+        command = cmd + '\n' + os.path.normpath(input_fname)   # only used for the cache key
+    else:
+        command = pyscfv_expandCommand(cmd, src_fname, dst_path, options, input_fname, encoding)
+    stages = pyscfv_pipelineStages(options, src_fname, dst_path, input_fname, encoding)
+
+    # check the render cache before spawning the filter
+    #   (the files it depends on are part of the key, so a change to one of those isn't served from the cache)
+    with pyscfv_timed('cache-lookup', section):
+        dependencies = pyscfv_knownDependencies(dst_path, options, src_fname)
+        key = pyscfv_renderCacheKey(src_fname, '\n|'.join( pyscfv_commandText(c) for c in [command] + stages ) + pyscfv_dependencyCacheText(dependencies), section, text)
+    if __pyscfv_cachePublished.get(dst_path) == key and os.path.exists(dst_path):
+        if __pyscfv_DEBUG: console.write('render cache: "{}" is already up to date\n'.format(dst_path))
+        pyscfv_storeTouch(dst_path, src_fname)
+        return dst_path
+    with pyscfv_storeBatch():
+        cached = pyscfv_renderCacheLookup(key)
+        reported = None if cached is None else pyscfv_reportedDependencies(cached, src_fname)
+        if cached is not None and not set(reported) - set(dependencies):
+            if __pyscfv_DEBUG: console.write('render cache: hit {}\n'.format(key))
+            staging = __pyscfv_stagingPath(dst_path)
+            import shutil
+            shutil.copyfile(cached, staging)
+            pyscfv_publishOutput(staging, dst_path)
+            pyscfv_storeTouch(dst_path, src_fname)
+            __pyscfv_cachePublished[dst_path] = key
+            pyscfv_recordDependencies(dst_path, (cmd, src_fname, section, text, options, encoding), __pyscfv_jobBuffer(job, dst_path), reported)
+            return dst_path
+
+    # a one-shot render gets a job of its own, so the Timeout= watchdog has something to kill
+    if job is None:
+        job = dict(bufferID=None, cancelled=False, timedout=None, process=None, pipeline=[], result=None)
+    if input_fname != src_fname:
+        __pyscfv_writeScopeFile(input_fname, text, src_fname)
+
+    # MaxProcesses= caps the number of filters running at once, so this might wait for a slot (see the filter supervisor)
+    with pyscfv_filterSlot(section):
+        if job['cancelled']:
+            return dst_path
+        f = open(__pyscfv_stagingPath(dst_path), mode='wb')
+
+        # with Progressive=1, the output of the last stage comes back through a pipe, to be published as it arrives
+        #   (a plugin or server with no further stages hands back its output all at once, so there's nothing to stream)
+        progressive = options is not None and __pyscfv_isTrue(options.get('progressive', '')) and (stages or not (plugin or server))
+        out = subprocess.PIPE if progressive else f
+        pump = None
+
+        # the later stages (if any) are started first, so the first stage can write straight into the pipeline
+        start = time()
+        watchdog = pyscfv_startWatchdog(job, options, section)
+        #   (timed as its own stage, so 'filter-spawn' stays one sample per render: starting the first stage)
+        downstream = []
+        if stages:
+            with pyscfv_timed('pipeline-spawn', section):
+                downstream = __pyscfv_startPipeline(stages, out, options)
+        if downstream:
+            __pyscfv_attachPipeline(job, [ s['process'] for s in downstream ])
+        sink = downstream[0]['process'].stdin if downstream else out
+        if progressive and downstream:
+            pump = __pyscfv_startPump(downstream[-1]['process'].stdout, f, dst_path, section, start, job, options, onProgress)
+
+        if plugin:
+            with pyscfv_timed('filter-runtime', section):
+                try:
+                    retval = pyscfv_run_plugin(cmd, input_fname, sink, stdin)
+                except IOError:
+                    if not downstream:
+                        raise
+                    retval = 1      # the second stage stopped reading; its own exit code will say why
+                if downstream:
+                    __pyscfv_closeQuietly(sink)
+        elif server:
+            with pyscfv_timed('filter-runtime', section):
+                try:
+                    retval = pyscfv_serve_file(cmd, input_fname, sink, stdin, job)
+                except IOError:
+                    if not downstream:
+                        raise
+                    retval = 1      # the second stage stopped reading; its own exit code will say why
+                __pyscfv_closeQuietly(sink)
+        else:
+            # this is experimenting with the cwd, so I don't need a `cd {} &&` prefix before command
+            #retval = subprocess.call( 'pwd && echo "{}"'.format(command) , stdout=f, cwd=os.path.normpath(tempfile.gettempdir()), shell=True )
+            with pyscfv_timed('filter-spawn', section):
+                p = pyscfv_spawnFilter( command, options, stdin=None if stdin is None else subprocess.PIPE, stdout=sink )
+                if downstream:
+                    __pyscfv_closeQuietly(sink)     # the first stage has its own copy; the next stage sees EOF when that one closes
+                elif progressive:
+                    pump = __pyscfv_startPump(p.stdout, f, dst_path, section, start, job, options, onProgress)
+            with pyscfv_timed('filter-runtime', section):
+                __pyscfv_attachProcess(job, p)
+                if stdin is not None:
+                    __pyscfv_writeStdin(p, stdin)
+                retval = p.wait()
+                pyscfv_releaseFilter(p)
+        if __pyscfv_DEBUG: console.write("after subprocess.call = {}\n". format(retval))
+        retval = __pyscfv_finishPipeline(dst_path, section, dict(stage=1, command=pyscfv_commandText(command), exitcode=retval, seconds=time() - start), downstream)
+        if watchdog is not None:
+            watchdog.cancel()
+        if pump is not None:
+            pump.join()
+        f.close()
+
+    # a cancelled render was killed part way through, so its output must not replace the published one
+    if job['cancelled']:
+        os.unlink(f.name)
+        return dst_path
+    pyscfv_recordCommandRuntime(section, cmd, time() - start)
+
+    # a render that timed out (or failed without any output) shows what went wrong, instead of a blank page
+    if job['timedout'] or (retval and not os.path.getsize(f.name)):
+        retval = retval or 1
+        with open(f.name, 'wb') as failed:
+            message = __pyscfv_failureMessage(job, retval, cmd if plugin or server else command, options)
+            failed.writelines([b'<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n<xmp>\n', message if isinstance(message, bytes) else message.encode('utf-8'), b'</xmp>\n</html>'])
+
+    # only successful renders go in the cache
+    with pyscfv_timed('output-write', section), pyscfv_storeBatch():
+        if retval == 0:
+            pyscfv_renderCacheStore(key, f.name)
+        pyscfv_publishOutput(f.name, dst_path)
+        pyscfv_storeTouch(dst_path, src_fname)
+    if retval == 0:
+        __pyscfv_cachePublished[dst_path] = key
+    else:
+        __pyscfv_cachePublished.pop(dst_path, None)
+    pyscfv_recordDependencies(dst_path, (cmd, src_fname, section, text, options, encoding), __pyscfv_jobBuffer(job, dst_path))
+    if __pyscfv_DEBUG: console.write('"{}": file = {} bytes\n'.format(dst_path, os.path.getsize(dst_path)))
+
+    return dst_path
 
+################################################################
+# command templates:
+#   each Command= is parsed just once, into an argument list with placeholders, and is run directly (without a shell,
+#   which saves starting cmd.exe for every filter, and means a path with spaces or & ^ ( ) in it can't confuse anything).
+#   The arguments are split at spaces, except inside double-quotes (which are removed); %NAME% environment variables are
+#   expanded when the command is parsed, and these placeholders when it's run:
+#       %1 or %{file}       the full path of the source file
+#       %{dir}              the folder of the source file
+#       %{basename}         the name of the source file, like readme.md
+#       %{name}             the name of the source file without its extension, like readme
+#       %{ext}              the extension of the source file, like .md
+#       %{output}           the full path of the filtered (output) file
+#       %{encoding}         the encoding of the Notepad++ buffer, like utf-8 or cp1252
+#   A command that needs a shell -- with | & < > outside of quotes, or whose program isn't a file (like the cmd.exe
+#   built-in `type`) -- is still run through the shell, with the placeholders substituted in the text.  Shell=1 always
+#   uses the shell, and Shell=0 never does.  Windows always runs a .bat or .cmd program with cmd.exe, which would split
+#   an unquoted argument at & ^ ( ) and the like, so each argument of a batch-file command that has a space or one of
+#   those characters in it is double-quoted (whether or not the config quoted it).
+__pyscfv_commandTemplates = {}          # command text => dict(argv=[ [literal or (placeholder,), ...] per argument ], shell=bool, batch=bool, text)
+__pyscfv_PLACEHOLDER = re.compile(r'%1|%\{(file|dir|basename|name|ext|output|encoding)\}', re.IGNORECASE)
+__pyscfv_ENVVAR = re.compile(r'%([A-Za-z_][A-Za-z0-9_()]*)%')
+__pyscfv_SHELL_CHARS = re.compile(r'[|&<>]' if os.name == 'nt' else r'[|&<>;$`*?(){}~]')
+__pyscfv_BATCH_CHARS = re.compile(r'[\s&|<>^(),;=!"]')
+
+def pyscfv_commandTemplate(cmd):
+    """returns the parsed template for the command text cmd: dict(argv, shell, text), parsing it only the first time"""
+    template = __pyscfv_commandTemplates.get(cmd)
+    if template is None:
+        text = __pyscfv_ENVVAR.sub(__pyscfv_expandEnvVar, cmd.strip())
+        argv = [ __pyscfv_splitPlaceholders(arg) for arg in __pyscfv_splitArguments(text) ]
+        unquoted = __pyscfv_PLACEHOLDER.sub('', re.sub(r'"[^"]*"', '', text))
+        program = __pyscfv_findProgram(argv[0][0]) if argv and len(argv[0]) == 1 and isinstance(argv[0][0], str) else ''
+        shell = not argv or bool(__pyscfv_SHELL_CHARS.search(unquoted)) or program is None
+        batch = os.name == 'nt' and bool(program) and os.path.splitext(program)[1].lower() in ('.bat', '.cmd')
+        template = __pyscfv_commandTemplates[cmd] = dict(argv=argv, shell=shell, batch=batch, text=text)
+        if __pyscfv_DEBUG: console.write('command template{}: {}\n'.format(' (shell)' if shell else '', argv))
+    return template
+
+def pyscfv_expandCommand(cmd, src_fname=None, dst_path=None, options=None, input_fname=None, encoding=None):
+    """returns the command text cmd, with its placeholders expanded: an argument list, or (if it needs a shell) a string
+
+    input_fname is the file for %1 (and %{file}), if that's not src_fname itself (like the scratch copy of a scoped render);
+    encoding is the source buffer's encoding for %{encoding} (utf-8 if it's None, like for a file that isn't open)"""
+    template = pyscfv_commandTemplate(cmd)
+    values = __pyscfv_placeholderValues(src_fname, dst_path, input_fname, encoding)
+    shell = template['shell']
+    if options is not None and options.get('shell', '').strip():
+        shell = __pyscfv_isTrue(options['shell'])
+    if shell:
+        return __pyscfv_PLACEHOLDER.sub(lambda m: values(m.group(1) or 'file'), template['text'])
+    argv = [ ''.join( part if isinstance(part, str) else values(part[0]) for part in arg ) for arg in template['argv'] ]
+    if template['batch']:
+        return ' '.join( __pyscfv_batchQuote(arg) for arg in argv )
+    return argv
+
+def pyscfv_commandText(command):
+    """returns an expanded command (argument list or string) as one string, for the cache key and for messages"""
+    import subprocess
+    return subprocess.list2cmdline(command) if isinstance(command, list) else command
+
+def __pyscfv_splitArguments(text):
+    """splits a command line into arguments at spaces, except inside double-quotes (which are removed), like windows does"""
+    args, current, quoted, started = [], [], False, False
+    for c in text:
+        if c == '"':
+            quoted = not quoted
+            started = True
+        elif c in ' \t' and not quoted:
+            if started:
+                args.append(''.join(current))
+            current, started = [], False
+        else:
+            current.append(c)
+            started = True
+    if started:
+        args.append(''.join(current))
+    return args
+
+def __pyscfv_splitPlaceholders(arg):
+    """splits one argument into a list of literal strings and (placeholder,) tuples"""
+    parts, pos = [], 0
+    for m in __pyscfv_PLACEHOLDER.finditer(arg):
+        if m.start() > pos:
+            parts.append(arg[pos:m.start()])
+        parts.append( ((m.group(1) or 'file').lower(),) )
+        pos = m.end()
+    if pos < len(arg) or not parts:
+        parts.append(arg[pos:])
+    return parts
+
+def __pyscfv_expandEnvVar(match):
+    """re.sub() callback: the value of the %NAME% environment variable, or the text unchanged if there's no such variable"""
+    name = match.group(1)
+    for key in (name, name.upper()) if os.name == 'nt' else (name,):
+        if key in os.environ:
+            return os.environ[key]
+    return match.group(0)
+
+def __pyscfv_batchQuote(arg):
+    """one argument for a cmd.exe command line: double-quoted if it's empty or has a space or a cmd.exe special character in it"""
+    if arg and not __pyscfv_BATCH_CHARS.search(arg):
+        return arg
+    return '"' + re.sub(r'(\\+)$', r'\1\1', arg.replace('"', '""')) + '"'
+
+def __pyscfv_findProgram(program):
+    """returns the path of program if it is a file that can be run directly (a path to it, or a name that's found on the PATH), else None"""
+    exts = [''] + ( os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').split(os.pathsep) if os.name == 'nt' else [] )
+    if os.path.dirname(program):
+        folders = ['']
+    else:
+        folders = [ d.strip('"') for d in os.environ.get('PATH', '').split(os.pathsep) if d ]
+    for folder in folders:
+        for ext in exts:
+            if os.path.isfile(os.path.join(folder, program) + ext):
+                return os.path.join(folder, program) + ext
+    return None
+
+def __pyscfv_placeholderValues(src_fname, dst_path, input_fname=None, encoding=None):
+    """returns a function that gives the value of a placeholder (by name) for this source (or input file) and output"""
+    src = os.path.normpath(src_fname) if src_fname else ''
+    def value(name):
+        name = name.lower()
+        if name == 'file':      return os.path.normpath(input_fname) if input_fname else src
+        if name == 'dir':       return os.path.dirname(src)
+        if name == 'basename':  return os.path.basename(src)
+        if name == 'name':      return os.path.splitext(os.path.basename(src))[0]
+        if name == 'ext':       return os.path.splitext(src)[1]
+        if name == 'output':    return dst_path or ''
+        if name == 'encoding':  return encoding or 'utf-8'
+        return ''
+    return value
+
+def __pyscfv_bufferEncoding(bufferID=None):
+    """the encoding of the Notepad++ buffer (default: the active one): utf-8 for any unicode buffer, or else the windows ANSI code page
+
+    This has to be called in the Notepad++ thread, like __pyscfv_filterInputs() does"""
+    if (notepad.getEncoding() if bufferID is None else notepad.getEncoding(bufferID)) != BUFFERENCODING.ENC8BIT:
+        return 'utf-8'
+    import locale
+    return locale.getpreferredencoding()
+
+# /end command templates
+################################################################
 
-    # replace %1 with the source file name
-    command = cmd.replace('%1', os.path.normpath(src_fname))
+################################################################
+# filter pipelines:
+#   Command= is the first stage of the filter; Command2=, Command3=, ... are optional further stages, each of which
+#   reads the STDOUT of the stage before it on its own STDIN, through an OS pipe.  So a chain like
+#   preprocess => pandoc => post-process needs no wrapper batch file and no temp files between the stages, and the
+#   stages all run at the same time.  The exit code and run time of every stage of the latest render of each output
+#   is available from pyscfv_getPipelineReport(), and each stage is timed in pyscfv_getStats() as 'filter-stageN'
+#   (and starting the stages after the first as 'pipeline-spawn')
+__pyscfv_pipelineReports = {}           # dst_path => [dict(stage, command, exitcode, seconds), ...]
+__pyscfv_CLOSE_FDS = os.name != 'nt'    # otherwise, one stage can inherit (and hold open) another stage's pipe; windows won't allow it with redirection
+
+def pyscfv_pipelineStages(options, src_fname, dst_path=None, input_fname=None, encoding=None):
+    """returns the commands for the stages after the first (Command2=, Command3=, ... up to the first one missing), expanded by pyscfv_expandCommand()"""
+    stages = []
+    if options is None:
+        return stages
+    n = 2
+    while options.get('command{}'.format(n), '').strip():
+        stages.append( pyscfv_expandCommand(options['command{}'.format(n)], src_fname, dst_path, options, input_fname, encoding) )
+        n += 1
+    return stages
+
+def __pyscfv_startPipeline(stages, f, options=None):
+    """starts the given stages piped one into the next, with the last one writing to the open file f (with the section's limits)
+
+    Returns a list of dict(stage, command, process, start); the first stage of the filter should write
+    to the STDIN of the first process in the list"""
+    import subprocess
+    started = []
+    for n, command in enumerate(stages, 2):
+        stdin = started[-1]['process'].stdout if started else subprocess.PIPE
+        stdout = f if n == len(stages) + 1 else subprocess.PIPE
+        start = time()
+        p = pyscfv_spawnFilter( command, options, stdin=stdin, stdout=stdout )
+        if started:
+            started[-1]['process'].stdout.close()     # now only this stage holds the read end of that pipe
+        started.append( dict(stage=n, command=pyscfv_commandText(command), process=p, start=start) )
+        if __pyscfv_DEBUG: console.write('pipeline stage {}: {}\n'.format(n, pyscfv_commandText(command)))
+    return started
+
+def __pyscfv_finishPipeline(dst_path, section, first, downstream):
+    """waits for the downstream stages, and records the report for dst_path, starting with the first stage's entry
+
+    Returns the exit code of the whole pipeline: the first non-zero exit code of any stage, or 0"""
+    report = [first]
+    for s in downstream:
+        exitcode = s['process'].wait()
+        pyscfv_releaseFilter(s['process'])
+        seconds = time() - s['start']
+        pyscfv_recordTiming('filter-stage{}'.format(s['stage']), seconds, section)
+        report.append( dict(stage=s['stage'], command=s['command'], exitcode=exitcode, seconds=seconds) )
+    __pyscfv_pipelineReports[dst_path] = report
+    if __pyscfv_DEBUG and downstream:
+        for r in report:
+            console.write('stage {stage}: exit {exitcode} after {seconds:.3f}s: {command}\n'.format(**r))
+    for r in report:
+        if r['exitcode']:
+            return r['exitcode']
+    return 0
+
+def pyscfv_getPipelineReport(dst_path):
+    """returns [dict(stage, command, exitcode, seconds), ...] for the latest render of the output dst_path, or None"""
+    return __pyscfv_pipelineReports.get(dst_path)
+
+def __pyscfv_closeQuietly(stream):
+    """closes stream, ignoring the error if the process at the other end of the pipe has already gone"""
+    try:
+        stream.close()
+    except IOError:
+        pass
+
+# /end filter pipelines
+################################################################
 
-    # this is experimenting with the cwd, so I don't need a `cd {} &&` prefix before command
-    #retval = subprocess.call( 'pwd && echo "{}"'.format(command) , stdout=f, cwd=os.path.normpath(tempfile.gettempdir()), shell=True )
-    retval = subprocess.call( command , stdout=f, cwd=os.path.normpath(tempfile.gettempdir()), shell=True )
-    if __pyscfv_DEBUG: console.write("after subprocess.call = {}\n". format(retval))
-    f.close()
-    if __pyscfv_DEBUG: console.write('"{}": file = {} bytes\n'.format(f.name, os.path.getsize(f.name)))
+################################################################
+# progressive output:
+#   with Progressive=1, the filter's output is read back from a pipe, one chunk at a time, and appended to the staging
+#   file (so the memory used doesn't grow with the size of the output).  Along the way, snapshots of the output so far
+#   are published, so the viewer can show the first screen of a huge document long before the filter is done: the
+#   first as soon as there's a screenful, or half a second after the output starts, then at doubling intervals (a timer
+#   takes the snapshots, so a filter that writes its first part and then goes quiet for a while still gets shown).  For
+#   viewers other than Viewer=http (which reloads the page itself), each snapshot ends with a meta-refresh tag, so the
+#   browser keeps reloading the file until the complete output (which has no such tag) replaces it.
+__pyscfv_PROGRESSIVE_FIRST_PAINT = 65536        # bytes of output that are enough for the first snapshot
+__pyscfv_PROGRESSIVE_INTERVAL = 0.5             # seconds from the first output to the first snapshot; doubled after each one
+__pyscfv_PROGRESSIVE_REFRESH = b'\n<meta http-equiv="refresh" content="1">\n'
+
+def __pyscfv_startPump(stream, f, dst_path, section, start, job, options, onProgress):
+    """starts the thread that copies the pipe stream into the staging file f, publishing snapshots on the way; returns the thread"""
+    thread = threading.Thread( target=__pyscfv_pumpOutput, args=(stream, f, dst_path, section, start, job, not __pyscfv_isHttpViewer(options), onProgress) )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def __pyscfv_pumpOutput(stream, f, dst_path, section, start, job, refresh, onProgress):
+    """copies the filter's output from the pipe stream to the staging file f, a chunk at a time, publishing snapshots of it along the way"""
+    fd = stream.fileno()
+    lock = threading.Lock()         # between this thread (writing f) and the snapshot timer (reading it)
+    state = dict(written=0, snapshots=0, interval=__pyscfv_PROGRESSIVE_INTERVAL, timer=None, done=False)
+
+    def snapshot():
+        with lock:
+            if state['done']:
+                return                                      # the complete output is about to be published instead
+            if state['timer'] is not None:
+                state['timer'].cancel()
+            state['timer'] = threading.Timer(state['interval'] * 2, snapshot)
+            state['timer'].daemon = True
+            state['timer'].start()
+            state['interval'] *= 2
+            if job is not None and job['cancelled']:
+                return                                      # a newer render owns dst_path now; the pump just drains the pipe
+            __pyscfv_publishSnapshot(f, dst_path, refresh)
+            if not state['snapshots']:
+                pyscfv_recordTiming('first-paint', time() - start, section)
+            state['snapshots'] += 1
+            if __pyscfv_DEBUG: console.write('progressive snapshot #{} of "{}": {} bytes\n'.format(state['snapshots'], dst_path, state['written']))
+        if onProgress is not None:
+            onProgress(dst_path)
+
+    try:
+        while True:
+            chunk = os.read(fd, __pyscfv_STDIN_CHUNK)     # (unlike stream.read(n), returns whatever has arrived so far)
+            if not chunk:
+                break
+            with lock:
+                f.write(chunk)
+                state['written'] += len(chunk)
+                if state['timer'] is None:
+                    state['timer'] = threading.Timer(state['interval'], snapshot)
+                    state['timer'].daemon = True
+                    state['timer'].start()
+                screenful = not state['snapshots'] and state['written'] >= __pyscfv_PROGRESSIVE_FIRST_PAINT
+            if screenful:
+                snapshot()
+    except (IOError, OSError) as e:
+        if __pyscfv_DEBUG: console.write('progressive output of "{}" stopped: {}\n'.format(dst_path, e))
+    finally:
+        with lock:
+            state['done'] = True
+            if state['timer'] is not None:
+                state['timer'].cancel()
+        __pyscfv_closeQuietly(stream)
+
+def __pyscfv_publishSnapshot(f, dst_path, refresh):
+    """publishes what has been written to the staging file f so far as dst_path (with a meta-refresh tag, if refresh)"""
+    f.flush()
+    import shutil
+    snapshot = __pyscfv_stagingPath(dst_path)       # (this is the pump thread, so it's not the same name as f)
+    with open(f.name, 'rb') as partial:
+        with open(snapshot, 'wb') as out:
+            shutil.copyfileobj(partial, out, __pyscfv_STDIN_CHUNK)
+            if refresh:
+                out.write(__pyscfv_PROGRESSIVE_REFRESH)
+    pyscfv_publishOutput(snapshot, dst_path)
+    __pyscfv_cachePublished.pop(dst_path, None)     # what's published isn't the cached render anymore
+
+# /end progressive output
+################################################################
+
+################################################################
+# in-process filter plugins:
+#   Command=python:module:function names a python function, which is called right here in PythonScript instead of
+#   running a filter process: no shell, no interpreter startup, and the imports are only paid for once.  module is
+#   either the name of an importable module, or the path to a .py file.  The function is called with the source
+#   text (the same bytes a filter would get on STDIN), and returns the output (bytes, or unicode, which is saved
+#   as UTF-8).  The module is imported the first time, and is re-imported whenever its source file changes.
+__pyscfv_PLUGIN_PREFIX = 'python:'
+__pyscfv_plugins = {}                   # cmd => dict(function, path, stamp)
+__pyscfv_pluginsLock = threading.RLock()
+
+def pyscfv_isPluginCommand(cmd):
+    """returns True if cmd is a python:module:function filter plugin rather than a command to run"""
+    return cmd.strip().lower().startswith(__pyscfv_PLUGIN_PREFIX)
+
+def __pyscfv_parsePluginCommand(cmd):
+    """'python:module:function' => (module, function); the module part may be the path of a .py file"""
+    module, sep, function = cmd.strip()[len(__pyscfv_PLUGIN_PREFIX):].rpartition(':')
+    module = os.path.expandvars( module.strip().strip('"') )
+    if not sep or not module or not function.strip():
+        raise ValueError('filter plugin "{}" should look like python:module:function'.format(cmd))
+    return module, function.strip()
+
+def __pyscfv_fileStamp(path):
+    """returns (mtime, size) of path, or None if there's no such file"""
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (st.st_mtime, st.st_size)
+
+def __pyscfv_pluginStamp(cmd):
+    """returns the stamp of the plugin's source file (loading the plugin if needed), or None if it can't be loaded"""
+    try:
+        return pyscfv_loadPlugin(cmd)['stamp']
+    except Exception:
+        return None     # pyscfv_run_plugin() will report the error
+
+def pyscfv_loadPlugin(cmd):
+    """returns dict(function, path, stamp) for the plugin cmd, importing its module the first time, and re-importing it if its file has changed"""
+    with __pyscfv_pluginsLock:
+        plugin = __pyscfv_plugins.get(cmd)
+        if plugin is not None and __pyscfv_fileStamp(plugin['path']) == plugin['stamp']:
+            return plugin
+        import imp
+        import importlib
+        module_name, function_name = __pyscfv_parsePluginCommand(cmd)
+        if module_name.lower().endswith('.py') or os.sep in module_name or '/' in module_name:
+            path = os.path.abspath(module_name)
+            if __pyscfv_DEBUG: console.write('loading filter plugin {}\n'.format(path))
+            # (the module name comes from the whole path, so two plugin files with the same name don't share a module)
+            import zlib
+            crc = zlib.crc32(os.path.normcase(path)) & 0xFFFFFFFF
+            module = imp.load_source( 'pyscfv_plugin_{}_{:08X}'.format(re.sub(r'\W', '_', os.path.splitext(os.path.basename(path))[0]), crc), path )
+        else:
+            module = sys.modules.get(module_name)
+            if module is None:
+                if __pyscfv_DEBUG: console.write('importing filter plugin {}\n'.format(module_name))
+                module = importlib.import_module(module_name)
+            elif plugin is not None:
+                if __pyscfv_DEBUG: console.write('reloading filter plugin {}\n'.format(module_name))
+                module = imp.reload(module)
+            path = getattr(module, '__file__', None)
+            if path is not None and path.lower().endswith(('.pyc', '.pyo')):
+                path = path[:-1]
+        if not hasattr(module, function_name):
+            raise ImportError('filter plugin "{}": {} has no function {}'.format(cmd, module_name, function_name))
+        plugin = dict(function=getattr(module, function_name), path=path, stamp=__pyscfv_fileStamp(path))
+        __pyscfv_plugins[cmd] = plugin
+        return plugin
+
+def pyscfv_run_plugin(cmd, src_fname, f, text=None):
+    """calls the plugin function for cmd on the source, and writes what it returns to the open file f
+
+    If text is None, the source is read from src_fname.  Returns 0 on success, like a filter's exit code;
+    if the plugin fails, the traceback is written to f instead, and 1 is returned"""
+    if __pyscfv_TRACE: console.write('pyscfv_run_plugin()\n')
+    if text is None:
+        with open(src_fname, 'rb') as src:
+            text = src.read()
+    try:
+        output = pyscfv_loadPlugin(cmd)['function'](text)
+    except Exception:
+        import traceback
+        error = traceback.format_exc()
+        console.writeError('pyscFilteredViewer: filter plugin "{}" failed for "{}":\n{}'.format(cmd, src_fname, error))
+        f.write(b''.join([b'<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n<xmp>\n', error if isinstance(error, bytes) else error.encode('utf-8'), b'</xmp>\n</html>']))
+        return 1
+    if not isinstance(output, bytes):
+        output = output.encode('utf-8')
+    f.write(output)
+    return 0
+
+def pyscfv_unloadPlugins():
+    """forgets all the loaded filter plugins, so each one is imported again the next time it's used"""
+    with __pyscfv_pluginsLock:
+        __pyscfv_plugins.clear()
+
+# /end in-process filter plugins
+################################################################
+
+################################################################
+# batch rendering:
+#   renders a whole list of files at once -- every open buffer, or every file under a folder that some section
+#   matches -- with one filter per CPU running at the same time.  Each filter is its own process, so a pool of
+#   threads (one per CPU) is enough to keep all the CPUs busy; filter plugins share this interpreter, though
+def pyscfv_batchRender(files, cfgDict=None, workers=None, onDone=None):
+    """renders each (fileName, langName) in files with the config section that matches it, with up to workers filters at once
+
+    langName may be None (so only the filename is matched); files that no section matches are skipped.
+    An entry may also be (fileName, langName, encoding), with the file's encoding in Notepad++ for %{encoding}.
+    workers defaults to the number of CPUs.  onDone(result) is called (from a worker thread) as each file finishes.
+    Returns a list of dict(source, section, output, exitcode, seconds, error) for the rendered files, in the order of files"""
+    if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_batchRender()\n')
+    if cfgDict is None:
+        cfgDict = pyscfv_getConfigDict()
+    results = []
+    encodings = {}
+    for entry in files:
+        fileName = os.path.abspath(entry[0])        # (filters run in the temp folder, so %1 has to be a full path)
+        section = pyscfv_matchSection(cfgDict, fileName, entry[1])
+        if section is not None and 'command' in cfgDict['config'][section]:
+            results.append( dict(source=fileName, section=section, output=None, exitcode=None, seconds=None, error=None) )
+            encodings[fileName] = entry[2] if len(entry) > 2 else None
+    if workers is None:
+        import multiprocessing
+        try:
+            workers = multiprocessing.cpu_count()
+        except NotImplementedError:
+            workers = 2
+    pending = iter(results)
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                result = next(pending, None)
+            if result is None:
+                return
+            __pyscfv_batchRenderOne(cfgDict, result, encodings[result['source']])
+            if onDone is not None:
+                onDone(result)
+
+    threads = [ threading.Thread(target=worker) for n in range(max(1, min(workers, len(results)))) ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def __pyscfv_batchRenderOne(cfgDict, result, encoding=None):
+    """renders one file for pyscfv_batchRender(), filling in the result"""
+    options = cfgDict['config'][result['section']]
+    start = time()
+    try:
+        text = None
+        if options.get('input', 'file').strip().lower() == 'stdin':
+            with open(result['source'], 'rb') as f:
+                text = f.read()     # there's no live buffer to send, so send the file
+        result['output'] = pyscfv_filter_file(options['command'], result['source'], result['section'], text, options=options, encoding=encoding)
+        report = pyscfv_getPipelineReport(result['output']) or []      # (no report if it came from a previous session's cache)
+        result['exitcode'] = ([ r['exitcode'] for r in report if r['exitcode'] ] or [0])[0]
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['seconds'] = time() - start
+
+def pyscfv_batchFilesInFolder(folder, cfgDict=None):
+    """returns [(fileName, None), ...] for pyscfv_batchRender(): every file under folder that a config section matches
+
+    (folders whose names start with a dot, like .git, are skipped)"""
+    if cfgDict is None:
+        cfgDict = pyscfv_getConfigDict()
+    files = []
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(folder)):
+        dirnames[:] = sorted( d for d in dirnames if not d.startswith('.') )
+        for name in sorted(filenames):
+            fileName = os.path.join(dirpath, name)
+            if pyscfv_matchSection(cfgDict, fileName) is not None:
+                files.append( (fileName, None) )
+    return files
+
+def pyscfv_batchFilesOpen():
+    """returns [(fileName, langName, encoding), ...] for pyscfv_batchRender(): every file that is open in Notepad++ and saved to disk"""
+    files = OrderedDict()
+    for fileName, bufferID, index, view in notepad.getFiles():
+        if fileName not in files and os.path.isfile(fileName):
+            files[fileName] = (fileName, __pyscfv_sessionLanguage(pyscfv_getSession(bufferID), notepad.getLangType(bufferID)), __pyscfv_bufferEncoding(bufferID))
+    return list(files.values())
+
+def pyscfv_BatchRenderOpenFiles():
+    """renders every open file (that a config section matches) in the background, and writes a summary to the console when done"""
+    if __pyscfv_TRACE: console.write('pyscfv_BatchRenderOpenFiles()\n')
+    cfgDict = pyscfv_getConfigDict()
+    files = pyscfv_batchFilesOpen()
+
+    def run():
+        start = time()
+        results = pyscfv_batchRender(files, cfgDict)
+        for r in results:
+            console.write( pyscfv_batchSummaryLine(r) )
+        console.write('pyscFilteredViewer: rendered {} of {} open files in {:.1f}s\n'.format(len(results), len(files), time() - start))
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+def pyscfv_batchSummaryLine(result):
+    """one line describing a pyscfv_batchRender() result"""
+    if result['error'] is not None:
+        status = 'ERROR'
+    elif result['exitcode']:
+        status = 'exit {}'.format(result['exitcode'])
+    else:
+        status = 'ok'
+    return '{:<8} {:>7.2f}s  [{}] {} => {}\n'.format(status, result['seconds'], result['section'], result['source'], result['error'] or result['output'])
 
-    return f.name
+# /end batch rendering
+################################################################
+
+################################################################
+# atomic output publishing:
+#   every output is written to a staging file in the same folder, and then renamed over the published file
+#   in one step, so a viewer that is watching the file never loads a truncated page.  If the new output is
+#   byte-for-byte the same as what is already published, the published file isn't touched at all, so there's
+#   no file-change notification; the digest of each published output is available from pyscfv_getPublishedDigest()
+__pyscfv_publishedDigests = {}          # dst_path => sha1 hexdigest of the published output
+
+def __pyscfv_stagingPath(dst_path):
+    """returns a staging-file name for dst_path which is unique to this process and thread"""
+    return '{}.{}-{}.tmp'.format(dst_path, os.getpid(), threading.current_thread().ident)
+
+def __pyscfv_fileDigest(path):
+    """returns the sha1 hexdigest of the contents of path"""
+    import hashlib
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def pyscfv_getPublishedDigest(dst_path):
+    """returns the sha1 hexdigest of the output currently published at dst_path, or None if there isn't one"""
+    if dst_path not in __pyscfv_publishedDigests:
+        if not os.path.exists(dst_path):
+            return None
+        __pyscfv_publishedDigests[dst_path] = __pyscfv_fileDigest(dst_path)     # published before this session
+    return __pyscfv_publishedDigests[dst_path]
+
+def pyscfv_publishOutput(staging, dst_path):
+    """moves the staging file into place as dst_path, unless its contents are identical to what's already there
+
+    Returns True if dst_path was replaced, False if it was already identical (in which case the staging file is just deleted)"""
+    if __pyscfv_TRACE: console.write('pyscfv_publishOutput()\n')
+    digest = __pyscfv_fileDigest(staging)
+    if digest == pyscfv_getPublishedDigest(dst_path) and os.path.exists(dst_path):
+        if __pyscfv_DEBUG: console.write('"{}" is unchanged: not re-publishing\n'.format(dst_path))
+        os.unlink(staging)
+        return False
+    __pyscfv_replaceFile(staging, dst_path)
+    __pyscfv_publishedDigests[dst_path] = digest
+    return True
+
+def __pyscfv_replaceFile(src, dst):
+    """renames src to dst, atomically replacing dst if it exists"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    elif os.name == 'nt':
+        # python 2 has no os.replace(), and os.rename() won't overwrite on windows
+        import ctypes
+        MOVEFILE_REPLACE_EXISTING = 0x1
+        MOVEFILE_WRITE_THROUGH = 0x8
+        if not ctypes.windll.kernel32.MoveFileExW( unicode(src), unicode(dst), MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH ):
+            # the viewer may have the file open without sharing delete access: fall back to overwriting it in place
+            import shutil
+            shutil.copyfile(src, dst)
+            os.unlink(src)
+    else:
+        os.rename(src, dst)
+
+# /end atomic output publishing
+################################################################
+
+################################################################
+# filter servers:
+#   with Server=1, the section's Command= is launched once, as a long-lived worker, and re-used for every render
+#   (so the interpreter startup of a pandoc or a perl/python script is only paid once).
+#   The worker is restarted automatically if it dies.  The protocol over the worker's STDIN/STDOUT is
+#       request:    "<length> <source path>\n" followed by exactly <length> bytes of source text
+#       response:   "<length>\n" followed by exactly <length> bytes of filtered output
+#   and the worker should exit when its STDIN is closed.  See ExampleFilterServer.py for a working example.
+__pyscfv_filterServers = {}             # command => dict(process=Popen, lock=Lock)
+__pyscfv_filterServersLock = threading.Lock()
+
+def pyscfv_serve_file(cmd, src_fname, f, text=None, job=None):
+    """sends the source to the filter server for cmd (launching the server if needed), and writes the response to the open file f
+
+    If text is None, the source is read from src_fname.  Returns 0 on success, like a filter's exit code"""
+    import subprocess
+    if __pyscfv_TRACE: console.write('pyscfv_serve_file()\n')
+    if text is None:
+        with open(src_fname, 'rb') as src:
+            text = src.read()
+
+    with __pyscfv_filterServersLock:
+        server = __pyscfv_filterServers.setdefault(cmd, dict(process=None, lock=threading.Lock()))
+
+    # one request at a time per server; if the server has died (or dies mid-request), restart it and try once more
+    with server['lock']:
+        for attempt in (1, 2):
+            if server['process'] is None or server['process'].poll() is not None:
+                if __pyscfv_DEBUG: console.write('starting filter server: {}\n'.format(cmd))
+                command = pyscfv_expandCommand(cmd)
+                server['process'] = pyscfv_spawnFilter( command, stdin=subprocess.PIPE, stdout=subprocess.PIPE )
+            p = server['process']
+            if job is not None:
+                __pyscfv_attachProcess(job, p)
+            try:
+                output = __pyscfv_serverRequest(p, src_fname, text)
+            except (IOError, ValueError) as e:
+                if __pyscfv_DEBUG: console.write('filter server request #{} failed: {}\n'.format(attempt, e))
+                __pyscfv_killProcess(p)
+                if job is not None and (job['cancelled'] or job['timedout']):
+                    break
+                continue
+            finally:
+                if job is not None:
+                    __pyscfv_attachProcess(job, None)   # done with the server, so cancelling the job must not kill it anymore
+            f.write(output)
+            return 0
+
+    console.writeError('pyscFilteredViewer: filter server "{}" did not answer for "{}"\n'.format(cmd, src_fname))
+    return 1
+
+def __pyscfv_serverRequest(p, src_fname, text):
+    """one request/response exchange with the filter server process p; returns the response body"""
+    p.stdin.write('{} {}\n'.format(len(text), os.path.normpath(src_fname)))
+    __pyscfv_writeChunks(p.stdin, text)
+    p.stdin.flush()
+    header = p.stdout.readline()
+    if not header:
+        raise IOError('filter server closed its STDOUT')
+    remaining = int(header.split()[0])
+    chunks = []
+    while remaining > 0:
+        chunk = p.stdout.read(min(remaining, __pyscfv_STDIN_CHUNK))
+        if not chunk:
+            raise IOError('filter server response was truncated')
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def pyscfv_stopFilterServers():
+    """stops all the filter servers; they will be restarted as needed"""
+    if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_stopFilterServers()\n')
+    with __pyscfv_filterServersLock:
+        servers = list(__pyscfv_filterServers.values())
+        __pyscfv_filterServers.clear()
+    for server in servers:
+        with server['lock']:
+            p = server['process']
+            if p is not None and p.poll() is None:
+                try:
+                    p.stdin.close()         # a well-behaved server exits at EOF...
+                except IOError:
+                    pass
+                __pyscfv_killProcess(p)     # ... but don't wait around for one that isn't
+
+# /end filter servers
+################################################################
+
+__pyscfv_STDIN_CHUNK = 65536
+def __pyscfv_writeChunks(stream, text):
+    """writes text to stream in chunks of __pyscfv_STDIN_CHUNK"""
+    for i in range(0, len(text), __pyscfv_STDIN_CHUNK):
+        stream.write(text[i:i+__pyscfv_STDIN_CHUNK])
+
+def __pyscfv_writeStdin(p, text):
+    """streams text into the STDIN of the subprocess p in chunks, then closes STDIN so the filter sees EOF"""
+    try:
+        __pyscfv_writeChunks(p.stdin, text)
+    except IOError:
+        # the filter exited (or closed its STDIN) without reading everything: let p.wait() report its exit code
+        if __pyscfv_DEBUG: console.write('filter stopped reading STDIN\n')
+    finally:
+        try:
+            p.stdin.close()
+        except IOError:
+            pass
+
+################################################################
+# filter supervisor:
+#   every filter process (each pipeline stage, and each filter server) is started by pyscfv_spawnFilter(), which puts it
+#   in a group of its own -- a job object on windows, a process group (session) elsewhere -- so that killing it kills
+#   everything it started, too (like the real filter under a cmd.exe, or the helpers that pandoc runs).  With
+#   MaxMemoryMB= or MaxCpuSeconds= (per section, or in the global settings), the group also gets those limits.
+#   Timeout= (seconds, per section or global) is a watchdog on each render: when it runs out, the filter is killed, and
+#   the output says so, so a hung or runaway filter can't hang the one-shot pyscFilteredViewer (or tie up a FilterOnSave
+#   worker) forever.  A filter plugin runs in PythonScript itself, so it can't be killed: only its later stages can.
+#   MaxProcesses= (global) caps how many filters can be running at once (a pipeline counts as one filter); the others
+#   wait their turn.  On windows, where the pipes can't be kept from being inherited (see __pyscfv_CLOSE_FDS), processes
+#   are started one at a time: while one Popen() has its pipe handles marked inheritable, a process that another render
+#   worker starts at the same moment (even a long-lived filter server) would inherit them too, and hold them open, so
+#   the stage that reads that pipe would never see the end of its input.
+__pyscfv_processSlots = dict(limit=None, semaphore=None)
+__pyscfv_spawnLock = threading.Lock()
+__pyscfv_processSlotsLock = threading.Lock()
+__pyscfv_JOB_OBJECT_LIMIT_PROCESS_TIME = 0x0002
+__pyscfv_JOB_OBJECT_LIMIT_PROCESS_MEMORY = 0x0100
+__pyscfv_JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE = 0x2000
+__pyscfv_JobObjectExtendedLimitInformation = 9
+
+def pyscfv_filterLimit(options, name):
+    """returns the number for the option name (like 'Timeout') from the section's options, or else the global setting; None if neither is set"""
+    value = (options or {}).get(name.lower(), '').strip() or pyscfv_getSetting(name, '').strip()
+    if not value or float(value) <= 0:
+        return None
+    return float(value)
+
+def pyscfv_spawnFilter(command, options=None, **kwargs):
+    """starts the filter command (with the other subprocess.Popen arguments), in a group of its own, with the section's limits"""
+    import subprocess
+    import tempfile
+    memory = pyscfv_filterLimit(options, 'MaxMemoryMB')
+    cpu = pyscfv_filterLimit(options, 'MaxCpuSeconds')
+    kwargs.update( cwd=os.path.normpath(tempfile.gettempdir()), shell=not isinstance(command, list), close_fds=__pyscfv_CLOSE_FDS )
+    if os.name != 'nt':
+        kwargs['preexec_fn'] = __pyscfv_posixLimits(memory, cpu)
+        p = subprocess.Popen(command, **kwargs)
+    else:
+        with __pyscfv_spawnLock:
+            p = subprocess.Popen(command, **kwargs)
+        # (there's a moment between starting the process and putting it in the job when it could start one of its own
+        #   outside the job; taskkill /T in __pyscfv_killProcess() still gets those)
+        p.pyscfv_job = __pyscfv_windowsJob(p, memory, cpu)
+    return p
+
+def __pyscfv_posixLimits(memory, cpu):
+    """returns the function that the child process runs before the filter: a new session (process group), and the rlimits"""
+    import resource         # (imported here, in the parent, not after the fork)
+    def limit():
+        os.setsid()
+        if memory is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (int(memory * 1024 * 1024),) * 2)
+        if cpu is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (int(-(-cpu // 1)),) * 2)
+    return limit
+
+def __pyscfv_windowsJob(p, memory, cpu):
+    """puts the process p in a new job object, with the memory (MB) and CPU (seconds) limits; returns the job handle, or None"""
+    import ctypes, ctypes.wintypes as wintypes
+    class BASIC_LIMIT(ctypes.Structure):
+        _fields_ = [('PerProcessUserTimeLimit', ctypes.c_int64), ('PerJobUserTimeLimit', ctypes.c_int64), ('LimitFlags', wintypes.DWORD),
+                    ('MinimumWorkingSetSize', ctypes.c_size_t), ('MaximumWorkingSetSize', ctypes.c_size_t), ('ActiveProcessLimit', wintypes.DWORD),
+                    ('Affinity', ctypes.c_size_t), ('PriorityClass', wintypes.DWORD), ('SchedulingClass', wintypes.DWORD)]
+    class EXTENDED_LIMIT(ctypes.Structure):
+        _fields_ = [('BasicLimitInformation', BASIC_LIMIT), ('IoInfo', ctypes.c_uint64 * 6), ('ProcessMemoryLimit', ctypes.c_size_t),
+                    ('JobMemoryLimit', ctypes.c_size_t), ('PeakProcessMemoryUsed', ctypes.c_size_t), ('PeakJobMemoryUsed', ctypes.c_size_t)]
+    kernel32 = wintypes.WinDLL('kernel32')
+    kernel32.CreateJobObjectW.restype = wintypes.HANDLE
+    job = kernel32.CreateJobObjectW(None, None)
+    if not job:
+        return None
+    info = EXTENDED_LIMIT()
+    info.BasicLimitInformation.LimitFlags = __pyscfv_JOB_OBJECT_LIMIT_KILL_ON_JOB_CLOSE
+    if memory is not None:
+        info.BasicLimitInformation.LimitFlags |= __pyscfv_JOB_OBJECT_LIMIT_PROCESS_MEMORY
+        info.ProcessMemoryLimit = int(memory * 1024 * 1024)
+    if cpu is not None:
+        info.BasicLimitInformation.LimitFlags |= __pyscfv_JOB_OBJECT_LIMIT_PROCESS_TIME
+        info.BasicLimitInformation.PerProcessUserTimeLimit = int(cpu * 10000000)     # in units of 100ns
+    if not (kernel32.SetInformationJobObject(wintypes.HANDLE(job), __pyscfv_JobObjectExtendedLimitInformation, ctypes.byref(info), ctypes.sizeof(info))
+            and kernel32.AssignProcessToJobObject(wintypes.HANDLE(job), wintypes.HANDLE(int(p._handle)))):
+        kernel32.CloseHandle(wintypes.HANDLE(job))
+        if __pyscfv_DEBUG: console.write('could not put filter process {} in a job object\n'.format(p.pid))
+        return None
+    return job
+
+def pyscfv_releaseFilter(p):
+    """once the filter process p has finished, closes its job object (which kills anything it left running)"""
+    job = getattr(p, 'pyscfv_job', None)
+    if job is not None:
+        import ctypes.wintypes as wintypes
+        p.pyscfv_job = None
+        wintypes.WinDLL('kernel32').CloseHandle(wintypes.HANDLE(job))
+
+def __pyscfv_killProcess(p):
+    """kills the subprocess p, and the whole process tree under it (the filter usually runs under a shell)"""
+    if p.poll() is not None:
+        pyscfv_releaseFilter(p)
+        return
+    try:
+        if os.name == 'nt':
+            import subprocess, ctypes.wintypes as wintypes
+            job = getattr(p, 'pyscfv_job', None)
+            if job is not None:
+                wintypes.WinDLL('kernel32').TerminateJobObject(wintypes.HANDLE(job), 1)
+            else:
+                with open(os.devnull, 'wb') as devnull:
+                    with __pyscfv_spawnLock:
+                        taskkill = subprocess.Popen( ['taskkill', '/F', '/T', '/PID', str(p.pid)], stdout=devnull, stderr=devnull )
+                    taskkill.wait()
+        else:
+            import signal
+            os.killpg(p.pid, signal.SIGKILL)
+    except OSError:
+        pass    # already gone
+
+@contextmanager
+def pyscfv_filterSlot(section=None):
+    """context manager which holds one of the MaxProcesses= slots while a filter runs (if MaxProcesses is set)"""
+    limit = int(pyscfv_filterLimit(None, 'MaxProcesses') or 0)
+    with __pyscfv_processSlotsLock:
+        if __pyscfv_processSlots['limit'] != limit:
+            __pyscfv_processSlots.update( limit=limit, semaphore=threading.Semaphore(limit) if limit else None )
+        semaphore = __pyscfv_processSlots['semaphore']
+    if semaphore is None:
+        yield
+        return
+    with pyscfv_timed('filter-wait', section):
+        semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+def pyscfv_startWatchdog(job, options, section=None):
+    """starts the Timeout= timer for the render job (if the section has a timeout); returns the timer, or None"""
+    timeout = pyscfv_filterLimit(options, 'Timeout')
+    if timeout is None:
+        return None
+    timer = threading.Timer(timeout, __pyscfv_timeoutRender, args=(job, timeout, section))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+def __pyscfv_timeoutRender(job, timeout, section):
+    """body of the watchdog: kills the filter of the job (and all its pipeline stages), which has taken too long"""
+    with __pyscfv_renderLock:
+        job['timedout'] = timeout
+        p = job['process']
+        pipeline = list(job['pipeline'])
+    console.writeError('pyscFilteredViewer: the filter for [{}] took longer than {} seconds; stopping it\n'.format(section, timeout))
+    pyscfv_recordTiming('filter-timeout', timeout, section)
+    if p is not None:
+        __pyscfv_killProcess(p)
+    for stage in pipeline:
+        __pyscfv_killProcess(stage)
+
+def __pyscfv_failureMessage(job, retval, command, options):
+    """the text shown in place of the output of a filter that timed out, or that failed without writing anything"""
+    if job['timedout']:
+        msg = 'The filter was stopped, because it took longer than Timeout={:g} seconds.\n'.format(job['timedout'])
+    else:
+        msg = 'The filter failed with exit code {}, and did not write anything.\n'.format(retval)
+        limits = [ '{}={:g}'.format(name, pyscfv_filterLimit(options, name)) for name in ('MaxMemoryMB', 'MaxCpuSeconds') if pyscfv_filterLimit(options, name) ]
+        if limits:
+            msg += 'It may have run out of {}.\n'.format(' or '.join(limits))
+    return msg + '\n' + pyscfv_commandText(command) + '\n'
+
+# /end filter supervisor
+################################################################
+
+################################################################
+# dependency tracking:
+#   a render can depend on more files than its source: stylesheets, templates, included chapters.  A section declares
+#   them with Depends= (space-separated paths or wildcards, relative to the source file's folder), or the filter reports
+#   them in its output, with a comment like <!-- pyscfv-depends: style.css; chapters/intro.md --> (separated by ; or by
+#   newlines, also relative to the source file's folder).  Each render records its dependencies and their modification
+#   times, in an index from each dependency to the outputs that depend on it; while FilterOnSave is registered, a watcher
+#   thread checks those files every DependsPoll= seconds (default 1), and re-renders just the outputs that depend on a
+#   file that changed.  The dependencies' modification times are also part of the render cache key.
+__pyscfv_DEPENDS_MARKER = re.compile(br'<!--\s*pyscfv-depends:(.*?)-->', re.DOTALL)
+__pyscfv_DEPENDS_POLL = 1.0
+__pyscfv_DEPENDS_CHUNK = 65536          # bytes of output read at a time, looking for the comments
+__pyscfv_dependencies = {}              # dst_path => dict(stamps={dependency: (mtime, size)}, reported=set, render=(cmd, src_fname, section, text, options, encoding), bufferID)
+__pyscfv_dependents = {}                # dependency => set of the dst_paths that depend on it
+__pyscfv_dependsLock = threading.Lock()
+__pyscfv_dependsWatcher = dict(thread=None, stop=None)
+
+def __pyscfv_dependencyPath(path):
+    """the form of path used in the dependency index"""
+    return os.path.normcase(os.path.abspath(path))
+
+def __pyscfv_dependencyStamp(path):
+    """(mtime, size) of the dependency, or None if it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def pyscfv_declaredDependencies(options, src_fname):
+    """the files named by the section's Depends= (with any wildcards expanded), relative to the folder of src_fname"""
+    import glob
+    folder = os.path.dirname(os.path.abspath(src_fname))
+    found = []
+    for pattern in (options or {}).get('depends', '').split():
+        pattern = os.path.join(folder, os.path.expandvars(pattern))
+        found.extend( glob.glob(pattern) if __pyscfv_isGlob(pattern) else [pattern] )
+    return [ __pyscfv_dependencyPath(p) for p in found ]
+
+def pyscfv_reportedDependencies(output, src_fname):
+    """the files that the filter reported in <!-- pyscfv-depends: ... --> comments in its output file, relative to the folder of src_fname"""
+    folder = os.path.dirname(os.path.abspath(src_fname))
+    found = []
+    for names in __pyscfv_dependsComments(output):
+        for name in re.split(br'[;\r\n]', names):
+            name = name.strip()
+            if name:
+                found.append( __pyscfv_dependencyPath(os.path.join(folder, name if isinstance(name, str) else name.decode('utf-8'))) )
+    return found
+
+def __pyscfv_dependsComments(output):
+    """yields the contents of each pyscfv-depends comment in the file output, reading it a chunk at a time (so a huge output isn't all in memory)"""
+    pending = b''
+    with open(output, 'rb') as f:
+        while True:
+            chunk = f.read(__pyscfv_DEPENDS_CHUNK)
+            if not chunk:
+                return
+            pending += chunk
+            end = 0
+            for match in __pyscfv_DEPENDS_MARKER.finditer(pending):
+                yield match.group(1)
+                end = match.end()
+            pending = pending[end:]
+            # keep a comment that hasn't been closed yet (unless it's too long to be one of these), or else just enough for a '<!--' split across chunks
+            start = pending.rfind(b'<!--')
+            if start < 0 or b'-->' in pending[start:] or len(pending) - start > __pyscfv_DEPENDS_CHUNK:
+                start = len(pending) - 3
+            pending = pending[max(start, 0):]
+
+def pyscfv_knownDependencies(dst_path, options, src_fname):
+    """the dependencies of the output dst_path: the declared ones, plus the ones its filter reported last time"""
+    dependencies = set(pyscfv_declaredDependencies(options, src_fname))
+    with __pyscfv_dependsLock:
+        record = __pyscfv_dependencies.get(dst_path)
+        if record is not None:
+            dependencies.update(record['reported'])
+    return sorted(dependencies)
+
+def pyscfv_dependencyCacheText(dependencies):
+    """the part of the render cache key for the dependencies: each one's path and modification time"""
+    return ''.join( '\n<{}:{}'.format(d, __pyscfv_dependencyStamp(d)) for d in dependencies )
+
+def pyscfv_recordDependencies(dst_path, render, bufferID=None, reported=None):
+    """records (and indexes) the dependencies of the render that was just published as dst_path
+
+    render is (cmd, src_fname, section, text, options, encoding), which is what the watcher needs to render it again.
+    reported is the list of dependencies the filter reported, if the caller has already read them from the output"""
+    cmd, src_fname, section, text, options, encoding = render
+    reported = set(pyscfv_reportedDependencies(dst_path, src_fname) if reported is None else reported)
+    dependencies = reported.union(pyscfv_declaredDependencies(options, src_fname))
+    stamps = { d: __pyscfv_dependencyStamp(d) for d in dependencies }
+    with __pyscfv_dependsLock:
+        __pyscfv_unindexDependencies(dst_path)
+        if dependencies:
+            __pyscfv_dependencies[dst_path] = dict(stamps=stamps, reported=reported, render=render, bufferID=bufferID)
+            for d in dependencies:
+                __pyscfv_dependents.setdefault(d, set()).add(dst_path)
+    if __pyscfv_DEBUG and dependencies: console.write('"{}" depends on {}\n'.format(dst_path, sorted(dependencies)))
+
+def __pyscfv_unindexDependencies(dst_path):
+    """removes dst_path from the dependency index (the caller holds __pyscfv_dependsLock)"""
+    record = __pyscfv_dependencies.pop(dst_path, None)
+    if record is None:
+        return
+    for d in record['stamps']:
+        outputs = __pyscfv_dependents.get(d)
+        if outputs is not None:
+            outputs.discard(dst_path)
+            if not outputs:
+                del __pyscfv_dependents[d]
+
+def __pyscfv_jobBuffer(job, dst_path):
+    """the buffer that the render job is for, or None (a re-render of a one-shot render is queued under its dst_path instead)"""
+    if job is None or job['bufferID'] == dst_path:
+        return None
+    return job['bufferID']
+
+def pyscfv_forgetDependencies(bufferID=None):
+    """forgets the dependencies of the renders of the buffer (or, if bufferID is None, of everything)"""
+    with __pyscfv_dependsLock:
+        for dst_path in [ p for p, r in __pyscfv_dependencies.items() if bufferID is None or r['bufferID'] == bufferID ]:
+            __pyscfv_unindexDependencies(dst_path)
+
+def pyscfv_checkDependencies():
+    """re-renders every output that depends on a file that has changed since it was rendered; returns those outputs"""
+    with __pyscfv_dependsLock:
+        index = { d: list(outputs) for d, outputs in __pyscfv_dependents.items() }
+    affected = set()
+    for d, outputs in index.items():
+        stamp = __pyscfv_dependencyStamp(d)     # (each file is checked once, however many outputs depend on it)
+        with __pyscfv_dependsLock:
+            for dst_path in outputs:
+                record = __pyscfv_dependencies.get(dst_path)
+                if record is not None and record['stamps'].get(d) != stamp:
+                    record['stamps'][d] = stamp     # so it isn't picked up again while it's being re-rendered
+                    affected.add(dst_path)
+    for dst_path in sorted(affected):
+        with __pyscfv_dependsLock:
+            record = __pyscfv_dependencies.get(dst_path)
+        if record is None:
+            continue
+        if __pyscfv_DEBUG: console.write('dependency changed: re-rendering "{}"\n'.format(dst_path))
+        cmd, src_fname, section, text, options, encoding = record['render']
+        bufferID = record['bufferID']
+        if bufferID is not None:
+            publish = lambda tmpfile, b=bufferID, o=options, s=section: __pyscfv_FilterOnSave_publish(b, tmpfile, o, s, False)
+        else:
+            publish = lambda tmpfile, o=options: __pyscfv_isHttpViewer(o) and pyscfv_previewPublish(tmpfile)
+        pyscfv_submitRender(dst_path if bufferID is None else bufferID, cmd, src_fname, section, text, publish, options, publish, encoding=encoding)
+    return sorted(affected)
+
+def pyscfv_startDependencyWatcher():
+    """starts the thread that checks the dependencies every DependsPoll= seconds (if it isn't already running)"""
+    if __pyscfv_dependsWatcher['thread'] is not None and __pyscfv_dependsWatcher['thread'].is_alive():
+        return
+    stop = threading.Event()
+    thread = threading.Thread( target=__pyscfv_watchDependencies, args=(stop,) )
+    thread.daemon = True
+    __pyscfv_dependsWatcher.update(thread=thread, stop=stop)
+    thread.start()
+
+def pyscfv_stopDependencyWatcher():
+    """stops the dependency watcher thread"""
+    if __pyscfv_dependsWatcher['stop'] is not None:
+        __pyscfv_dependsWatcher['stop'].set()
+    __pyscfv_dependsWatcher.update(thread=None, stop=None)
+
+def __pyscfv_watchDependencies(stop):
+    """body of the dependency watcher thread"""
+    while not stop.wait( float(pyscfv_getSetting('DependsPoll', '').strip() or __pyscfv_DEPENDS_POLL) ):
+        try:
+            pyscfv_checkDependencies()
+        except Exception as e:
+            console.writeError('pyscFilteredViewer: checking dependencies failed: {}\n'.format(e))
+
+# /end dependency tracking
+################################################################
+
+################################################################
+# background rendering:
+#   FilterOnSave hands each render off to a queue, so the Notepad++ callback returns immediately, and a few worker
+#   threads (RenderWorkers=, default one per CPU) take renders off the queue.  There is at most one render per buffer
+#   in the queue or in flight: a newer save of the same buffer replaces the one still waiting in the queue (so the
+#   burst of saves from Save All, or from saving over and over, only renders each buffer once), or cancels (kills)
+#   the one in flight; only the latest render for each buffer gets published.  A render submitted with first=True
+#   (the active buffer) goes to the front of the queue.  Two renders of the same buffer never run at the same time.
+__pyscfv_renderJobs = {}                # bufferID => latest job for that buffer (queued or running)
+__pyscfv_renderQueue = []               # jobs waiting for a worker, in order
+__pyscfv_renderRunning = {}             # bufferID => job that a worker is running (which might have been cancelled)
+__pyscfv_renderWorkers = [0]            # number of worker threads
+__pyscfv_renderLock = threading.Lock()
+__pyscfv_renderIdle = threading.Condition(__pyscfv_renderLock)
+
+def pyscfv_submitRender(bufferID, cmd, src_fname, section, text=None, onDone=None, options=None, onProgress=None, first=False, encoding=None):
+    """queues src_fname to be filtered by a background worker, and returns the job (a dict) without waiting for it
+
+    If there is already a render waiting in the queue for bufferID, it is replaced; if one is in flight, it is cancelled.
+    When the render finishes, onDone(tmpfile) is called from the worker thread, but only if this job
+    is still the latest one for bufferID; the same goes for onProgress(tmpfile), after each partial
+    publish of a Progressive=1 render.  With first=True, the job goes to the front of the queue.
+    encoding is the buffer's encoding for %{encoding}, since the worker can't ask Notepad++ for it"""
+    if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_submitRender({})\n'.format(bufferID))
+    job = dict(bufferID=bufferID, cancelled=False, timedout=None, process=None, pipeline=[], result=None, args=(cmd, src_fname, section, text, onDone, options, onProgress, encoding))
+    maxWorkers = __pyscfv_renderWorkerLimit()
+    with __pyscfv_renderLock:
+        previous = __pyscfv_renderJobs.get(bufferID)
+        __pyscfv_renderJobs[bufferID] = job
+        if previous is not None and previous in __pyscfv_renderQueue:
+            __pyscfv_renderQueue.remove(previous)       # it never started, so it's just dropped
+            previous['cancelled'] = True
+            previous = None
+        if first:
+            __pyscfv_renderQueue.insert(0, job)
+        else:
+            __pyscfv_renderQueue.append(job)
+        startWorker = __pyscfv_renderWorkers[0] < maxWorkers
+        if startWorker:
+            __pyscfv_renderWorkers[0] += 1
+    if previous is not None:
+        pyscfv_cancelRender(previous)
+    if startWorker:
+        thread = threading.Thread( target=__pyscfv_renderWorker )
+        thread.daemon = True
+        thread.start()
+    return job
+
+def __pyscfv_renderWorkerLimit():
+    """the RenderWorkers= setting, or else the number of CPUs"""
+    workers = pyscfv_getSetting('RenderWorkers', '').strip()
+    if workers:
+        return max(1, int(workers))
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 2
+
+def pyscfv_cancelRender(job):
+    """cancels the given render job, killing its filter process if it has already started"""
+    if __pyscfv_DEBUG: console.write('pyscfv_cancelRender({})\n'.format(job['bufferID']))
+    with __pyscfv_renderLock:
+        job['cancelled'] = True
+        p = job['process']
+        pipeline = list(job['pipeline'])
+        if __pyscfv_renderJobs.get(job['bufferID']) is job:
+            del __pyscfv_renderJobs[job['bufferID']]
+        if job in __pyscfv_renderQueue:
+            __pyscfv_renderQueue.remove(job)
+        __pyscfv_renderIdle.notify_all()
+    if p is not None:
+        __pyscfv_killProcess(p)
+    for stage in pipeline:
+        __pyscfv_killProcess(stage)
+
+def pyscfv_cancelAllRenders():
+    """cancels every render that is still in flight"""
+    with __pyscfv_renderLock:
+        jobs = list(__pyscfv_renderJobs.values())
+    for job in jobs:
+        pyscfv_cancelRender(job)
+
+def __pyscfv_attachProcess(job, p):
+    """records the filter process for the job, so that it can be killed; kills it right away if the job was already cancelled"""
+    with __pyscfv_renderLock:
+        job['process'] = p
+        cancelled = job['cancelled'] or job['timedout']
+    if cancelled and p is not None:
+        __pyscfv_killProcess(p)
+
+def __pyscfv_attachPipeline(job, processes):
+    """records the later stages of the job's filter pipeline, so they are killed along with the filter if the job is cancelled"""
+    with __pyscfv_renderLock:
+        job['pipeline'] = processes
+        cancelled = job['cancelled'] or job['timedout']
+    if cancelled:
+        for p in processes:
+            __pyscfv_killProcess(p)
+
+def pyscfv_waitForRenders(timeout=None):
+    """waits until no render is queued or in flight (including publishing its result); returns False if timeout seconds passed first"""
+    deadline = None if timeout is None else time() + timeout
+    with __pyscfv_renderLock:
+        while __pyscfv_renderQueue or __pyscfv_renderRunning:
+            if deadline is None:
+                __pyscfv_renderIdle.wait(1.0)
+            elif time() >= deadline:
+                return False
+            else:
+                __pyscfv_renderIdle.wait(deadline - time())
+        return True
+
+def __pyscfv_renderWorker():
+    """body of a background render thread: runs queued jobs until there are none it can run"""
+    while True:
+        # the cancelled render for the same buffer writes to the same output file, so a job waits until that one is done
+        with __pyscfv_renderLock:
+            job = next( (j for j in __pyscfv_renderQueue if j['bufferID'] not in __pyscfv_renderRunning), None )
+            if job is None:
+                __pyscfv_renderWorkers[0] -= 1
+                return
+            __pyscfv_renderQueue.remove(job)
+            __pyscfv_renderRunning[job['bufferID']] = job
+        try:
+            __pyscfv_runRenderJob(job, *job['args'])
+        finally:
+            # the job stays registered until it's completely done, so pyscfv_waitForRenders() can wait for the publishing, too
+            with __pyscfv_renderLock:
+                del __pyscfv_renderRunning[job['bufferID']]
+                if __pyscfv_renderJobs.get(job['bufferID']) is job:
+                    del __pyscfv_renderJobs[job['bufferID']]
+                __pyscfv_renderIdle.notify_all()
+
+def __pyscfv_runRenderJob(job, cmd, src_fname, section, text, onDone, options, onProgress, encoding):
+    """renders one job, in a worker thread, and publishes it with onDone if it's still the latest for its buffer"""
+    def progress(tmpfile):
+        with __pyscfv_renderLock:
+            stale = job['cancelled'] or __pyscfv_renderJobs.get(job['bufferID']) is not job
+        if not stale and onProgress is not None:
+            onProgress(tmpfile)
+
+    if job['cancelled']:
+        return
+
+    try:
+        job['result'] = pyscfv_filter_file(cmd, src_fname, section, text, job, options, progress, encoding)
+    except Exception as e:
+        console.writeError('pyscFilteredViewer: background render of "{}" failed: {}\n'.format(src_fname, e))
+        return
+
+    with __pyscfv_renderLock:
+        stale = job['cancelled'] or __pyscfv_renderJobs.get(job['bufferID']) is not job
+    if stale:
+        if __pyscfv_DEBUG: console.write('discarding stale render of "{}"\n'.format(src_fname))
+        return
+
+    if onDone is not None:
+        onDone(job['result'])
+
+# /end background rendering
+################################################################
 
 def pyscfv_launch_default_app(fname):
     """uses os.startfile() to launch the file with the default windows association"""
@@ -351,6 +2475,215 @@ def pyscfv_launch_default_app(fname):
     # os.startfile()    # https://docs.python.org/2/library/os.html#os.startfile
     if os.path.exists(fname): os.startfile(fname)
 
+def pyscfv_launch_viewer(fname, options=None, section=None):
+    """launches the viewer for the filtered file, based on the section's Viewer= setting
+
+        Viewer=default  => pyscfv_launch_default_app()
+        Viewer=http     => publish it on the local preview server, and open its URL in the default browser
+    """
+    if __pyscfv_TRACE: console.write('pyscfv_launch_viewer()\n')
+    with pyscfv_timed('viewer-launch', section):
+        if __pyscfv_isHttpViewer(options):
+            pyscfv_previewPublish(fname)
+            __import__('webbrowser').open( pyscfv_previewURL(fname) )
+        else:
+            pyscfv_launch_default_app(fname)
+
+def __pyscfv_isHttpViewer(options):
+    """true if the section wants its output shown through the local preview server"""
+    return options is not None and options.get('viewer', 'default').strip().lower() == 'http'
+
+################################################################
+# local preview server:
+#   with Viewer=http, the filtered output is served from memory by a small HTTP server on the loopback interface.
+#   Each page keeps a Server-Sent Events connection open, and when a new render is published, the server
+#   pushes the new version number and the page reloads itself (keeping its scroll position), so the browser
+#   updates as soon as the filter finishes, without the user hitting refresh.
+__pyscfv_preview = dict(server=None, thread=None, pages={}, condition=threading.Condition())
+__pyscfv_PREVIEW_KEEPALIVE = 15.0   # seconds between keep-alive comments on an idle event stream
+
+__pyscfv_PREVIEW_SCRIPT = '''<script>
+(function () {
+    var version = %(version)d, key = 'pyscfv-scroll:' + location.pathname;
+    window.addEventListener('load', function () {
+        var y = sessionStorage.getItem(key);
+        if (y !== null) { window.scrollTo(0, +y); sessionStorage.removeItem(key); }
+    });
+    var events = new EventSource('/events/%(name)s?v=' + version);
+    events.onmessage = function (e) {
+        if (+e.data !== version) { sessionStorage.setItem(key, window.pageYOffset); events.close(); location.reload(); }
+    };
+})();
+</script>
+'''
+
+def pyscfv_startPreviewServer(port=None):
+    """starts the local preview server (if it isn't already running), and returns its port
+
+    If port is None, the PreviewPort setting is used; if that's not set either, the OS picks a free port"""
+    if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_startPreviewServer()\n')
+    with __pyscfv_preview['condition']:
+        if __pyscfv_preview['server'] is not None:
+            return __pyscfv_preview['server'].server_address[1]
+        if port is None:
+            port = int(pyscfv_getSetting('PreviewPort', 0))
+        server = __pyscfv_makePreviewServer(port)
+        __pyscfv_preview['server'] = server
+        __pyscfv_preview['thread'] = threading.Thread( target=server.serve_forever )
+        __pyscfv_preview['thread'].daemon = True
+        __pyscfv_preview['thread'].start()
+        if __pyscfv_DEBUG: console.write('preview server listening on {}\n'.format(server.server_address))
+        return server.server_address[1]
+
+def pyscfv_stopPreviewServer():
+    """stops the local preview server, and forgets the published pages"""
+    if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_stopPreviewServer()\n')
+    with __pyscfv_preview['condition']:
+        server = __pyscfv_preview['server']
+        __pyscfv_preview.update(server=None, thread=None, pages={})
+        __pyscfv_preview['condition'].notify_all()
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+def pyscfv_previewURL(fname):
+    """returns the preview-server URL for the filtered file, starting the server if needed"""
+    import urllib
+    port = pyscfv_startPreviewServer()
+    return 'http://127.0.0.1:{}/view/{}'.format(port, urllib.quote(os.path.basename(fname)))
+
+def pyscfv_previewPublish(fname):
+    """publishes the current contents of the filtered file on the preview server, and pushes a reload to any open pages
+
+    Returns the page's new version number"""
+    if __pyscfv_TRACE: console.write('pyscfv_previewPublish()\n')
+    name = os.path.basename(fname)
+    digest = pyscfv_getPublishedDigest(fname)
+    with __pyscfv_preview['condition']:
+        page = __pyscfv_preview['pages'].get(name)
+        if page is not None and digest is not None and page['digest'] == digest:
+            return page['version']      # same output as before: no need to make the browser reload
+    with open(fname, 'rb') as f:
+        html = f.read()
+    with __pyscfv_preview['condition']:
+        page = __pyscfv_preview['pages'].get(name)
+        version = 1 if page is None else page['version'] + 1
+        __pyscfv_preview['pages'][name] = dict(html=html, version=version, digest=digest)
+        __pyscfv_preview['condition'].notify_all()
+    return version
+
+def pyscfv_previewPage(name):
+    """returns (html, version) for the published page name, or (None, 0) if it hasn't been published"""
+    with __pyscfv_preview['condition']:
+        page = __pyscfv_preview['pages'].get(name)
+    if page is None:
+        return None, 0
+    return page['html'], page['version']
+
+def pyscfv_previewPages():
+    """returns the sorted list of published page names"""
+    with __pyscfv_preview['condition']:
+        return sorted(__pyscfv_preview['pages'])
+
+def pyscfv_previewWait(name, version, timeout):
+    """waits up to timeout seconds for the page name to move past version; returns the current version (None once the server is stopped)"""
+    condition = __pyscfv_preview['condition']
+    with condition:
+        page = __pyscfv_preview['pages'].get(name)
+        if __pyscfv_preview['server'] is not None and (page is None or page['version'] == version):
+            condition.wait(timeout)
+            page = __pyscfv_preview['pages'].get(name)
+        if __pyscfv_preview['server'] is None:
+            return None
+        return 0 if page is None else page['version']
+
+def pyscfv_previewInject(html, name, version):
+    """adds the live-reload script to the html, just before </body> if there is one, otherwise at the end"""
+    import urllib
+    script = __pyscfv_PREVIEW_SCRIPT % dict(version=version, name=urllib.quote(name))
+    at = html.lower().rfind(b'</body>')
+    if at < 0:
+        return html + script
+    return html[:at] + script + html[at:]
+
+def __pyscfv_makePreviewServer(port):
+    """builds the (threaded) HTTP server for the preview pages, bound to the loopback interface"""
+    import BaseHTTPServer
+    import SocketServer
+    import urllib
+    keepalive = __pyscfv_PREVIEW_KEEPALIVE      # (names starting with __ can't be used inside the class bodies below)
+
+    class PreviewRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """serves /view/<name> (the page, with the live-reload script) and /events/<name> (the reload event stream)"""
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+            kind, _, name = path.lstrip('/').partition('/')
+            name = urllib.unquote(name)
+            if kind == 'view':
+                self.send_page(name)
+            elif kind == 'events':
+                self.send_events(name, query)
+            elif kind == '':
+                self.send_index()
+            else:
+                self.send_error(404)
+
+        def send_page(self, name):
+            html, version = pyscfv_previewPage(name)
+            if html is None:
+                return self.send_error(404, 'Not published: {}'.format(name))
+            body = pyscfv_previewInject(html, name, version)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_events(self, name, query):
+            version = 0
+            for pair in query.split('&'):
+                k, _, v = pair.partition('=')
+                if k == 'v' and v.isdigit():
+                    version = int(v)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            try:
+                while True:
+                    current = pyscfv_previewWait(name, version, keepalive)
+                    if current is None:
+                        break       # server is stopping
+                    if current != version:
+                        version = current
+                        self.wfile.write('data: {}\n\n'.format(version))
+                    else:
+                        self.wfile.write(': keep-alive\n\n')
+                    self.wfile.flush()
+            except (IOError, OSError):
+                pass    # the browser went away
+
+        def send_index(self):
+            links = ''.join( '<li><a href="/view/{0}">{1}</a></li>\n'.format(urllib.quote(n), n.replace('&', '&amp;').replace('<', '&lt;')) for n in pyscfv_previewPages() )
+            body = '<!DOCTYPE html>\n<meta charset="UTF-8">\n<html>\n<h1>pyscFilteredViewer</h1>\n<ul>\n{}</ul>\n</html>\n'.format(links)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass    # don't spam the PythonScript console
+
+    class PreviewServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+    return PreviewServer( ('127.0.0.1', port), PreviewRequestHandler )
+
+# /end local preview server
+################################################################
+
 def pyscfv_establishConfigFile():
     """Establishes a valid Config File, and returns the name to it
 
@@ -419,8 +2752,7 @@ def pyscfv_FilteredViewer():
     """Configures and runs the filter for one-shot useage"""
     if __pyscfv_TRACE: console.write('pyscfv_FilteredViewer()\n')
 
-    configObj  = pyscfv_readFiltersIni()
-    configDict = pyscfv_parseConfig(configObj)
+    configDict = pyscfv_getConfigDict()
     section    = pyscfv_pickSectionBasedOnActiveFile(configDict, True)
     if section is None: return
     tmpfile    = pyscfv_diplayFilteredOutput(configDict, section)
@@ -430,7 +2762,7 @@ def pyscfv_FilteredViewer():
 def pyscfv_Register_FilterOnSave():
     """Register the pyscfv_FilterOnSave function for the FILESAVED event"""
     if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_Register_FilterOnSave()\n')
-    pyscfv_Callback_FilterOnSave.configDict = pyscfv_parseConfig( pyscfv_readFiltersIni() )
+    pyscfv_Callback_FilterOnSave.configDict = pyscfv_getConfigDict()
 
     # run it once making sure to launch the application,
     # but the callback version will not relaunch (so refreshes in the browser are user's responsibility)
@@ -439,14 +2771,15 @@ def pyscfv_Register_FilterOnSave():
     tmpfile    = pyscfv_diplayFilteredOutput(pyscfv_Callback_FilterOnSave.configDict, section, skipLaunch=False)
     if __pyscfv_DEBUG: console.write('\tsection={}\n\ttmpfile={}\n'.format(section, tmpfile))
 
-    pyscfv_Callback_FilterOnSave.tmpfiles = [tmpfile]
+    pyscfv_getSession(notepad.getCurrentBufferID()).update(output=tmpfile, launched=True)
 
     # register the callback
     notepad.callback(pyscfv_Callback_FilterOnSave, [NOTIFICATION.FILESAVED])
     # added secondary callback to keep the icon present
     notepad.callback(pyscfv_Callback_BufferActivated_OverrideStatusBar, [NOTIFICATION.BUFFERACTIVATED])
+    # and re-render when a file that a rendered file depends on changes
+    pyscfv_startDependencyWatcher()
 
-    if __pyscfv_DEBUG: console.write('Tempfiles at end of Register FilterOnSave = {}\n'.format(pyscfv_Callback_FilterOnSave.tmpfiles))
 
     # notify the UI that it's registered
     pyscfv_OverrideStatusBar(True)
@@ -455,7 +2788,7 @@ def pyscfv_OverrideStatusBar(filterIsOn):
     """if filterIsOn, override status bar to indicate filter, otherwise return to default status bar"""
     if __pyscfv_DEBUG or __pyscfv_TRACE: console.write('pyscfv_OverrideStatusBar()\n')
     #fileLangDesc = notepad.getLanguageDesc(notepad.getCurrentLang())    # converts LANGTYPE to the official string for the selected language
-    fileLangDesc = __eko_getLexerDesc()     # alternate way to convert LANGTYPE to the official description-string for the selected language
+    fileLangDesc = __pyscfv_sessionLexer(pyscfv_getSession(notepad.getCurrentBufferID()), notepad.getCurrentLang())[1]    # alternate way to convert LANGTYPE to the official description-string for the selected language
     if filterIsOn:
         strStatusBar =  u'{} {}'.format( u'\u00A0⇉📺⇉\u00A0', fileLangDesc )                         # ⇉📺⇉ TYPE
     else:
@@ -468,8 +2801,12 @@ def pyscfv_UnRegister_FilterOnSave():
     pyscfv_Callback_FilterOnSave.configDict = None
     notepad.clearCallbacks(pyscfv_Callback_FilterOnSave)
     notepad.clearCallbacks(pyscfv_Callback_BufferActivated_OverrideStatusBar) # secondary callback to keep the icon present
+    pyscfv_stopDependencyWatcher()
+    pyscfv_cancelFullRender()
+    pyscfv_cancelAllRenders()
+    pyscfv_stopFilterServers()
 
-    pyscfv_Callback_FilterOnSave.tmpfiles = []
+    pyscfv_forgetSessions(launchOnly=True)
 
     # notify the UI that it's unregistered
     pyscfv_OverrideStatusBar(False)
@@ -495,35 +2832,68 @@ def pyscfv_Callback_FilterOnSave(kwargs):
     if pyscfv_Callback_FilterOnSave.configDict is None:
         raise pyscFilteredViewer_Exception('FilterOnSave Callback was not properly registered')
 
-    # debug
-    if __pyscfv_DEBUG: console.write('Existing Tempfiles before Callback FilterOnSave = {}\n'.format(pyscfv_Callback_FilterOnSave.tmpfiles))
+    # pick up any edits to the config file since the last save
+    configDict = pyscfv_Callback_FilterOnSave.configDict = pyscfv_getConfigDict()
 
-    # grab section for current file
-    section    = pyscfv_pickSectionBasedOnActiveFile(pyscfv_Callback_FilterOnSave.configDict, False)
+    # grab section for the saved file (with Save All, that's not necessarily the active one)
+    activeID   = notepad.getCurrentBufferID()
+    bufferID   = kwargs.get('bufferID', activeID)
+    section    = pyscfv_pickSectionForBuffer(configDict, bufferID, False)
 
-    # re-filter the file once without displaying (logic for displaying was easier later)
-    tmpfile = pyscfv_diplayFilteredOutput(pyscfv_Callback_FilterOnSave.configDict, section, skipLaunch=True)
+    # without a section, there's no filter to run in the background: just display the error message
+    #   (but only for the active file: Save All may well save files that were never meant to be filtered)
+    if section is None:
+        if bufferID != activeID: return
+        tmpfile = pyscfv_diplayFilteredOutput(configDict, section, skipLaunch=True)
+        __pyscfv_FilterOnSave_publish(bufferID, tmpfile, None, None)
+        return
+
+    # ensure it has a filter command
+    if pyscfv_errorCheckSection(configDict, section) is None:
+        return
+
+    # re-filter the file in the background, without displaying (logic for displaying is in the publish step)
+    #   (with FastCommand=, that might be the fast command now, and the full one once the buffer is idle)
+    command, sourceFile, sourceText, encoding = __pyscfv_filterInputs(configDict, section, bufferID)
+    options = configDict['config'][section]
+    active  = bufferID == activeID
+    publish = lambda tmpfile: __pyscfv_FilterOnSave_publish(bufferID, tmpfile, options, section, active)
+    pyscfv_cancelFullRender(bufferID)
+    tierCommand, fast = pyscfv_chooseTier(options, section)
+    pyscfv_submitRender(bufferID, tierCommand, sourceFile, section, sourceText, publish, options, publish, first=active, encoding=encoding)
+    if fast:
+        pyscfv_scheduleFullRender(bufferID, command, sourceFile, section, sourceText, publish, options, encoding)
 
-    # by updating without launching (above), then I can use the returned tmpfile to determine whether or not to launch (here)
-    if not tmpfile in pyscfv_Callback_FilterOnSave.tmpfiles:
-        pyscfv_launch_default_app(tmpfile)
-        pyscfv_Callback_FilterOnSave.tmpfiles.append(tmpfile)
+    return
 
-    if __pyscfv_DEBUG: console.write('Tempfiles at end of Callback FilterOnSave = {}\n'.format(pyscfv_Callback_FilterOnSave.tmpfiles))
+def __pyscfv_FilterOnSave_publish(bufferID, tmpfile, options, section, launch=True):
+    """publishes a finished FilterOnSave render: launches the viewer the first time the buffer's tmpfile is rendered, and updates the status bar
+
+    With Viewer=http, every render is also pushed to the preview server, so an open page reloads itself.
+    With launch=False (a buffer that was saved in the background, by Save All), the viewer is not launched;
+    that waits until the buffer is saved while it's the active one"""
+    if tmpfile is None: return
+
+    # by updating without launching, then I can use the buffer's session to determine whether or not to launch (here)
+    session = pyscfv_getSession(bufferID)
+    if not session['launched'] or session['output'] != tmpfile:
+        if not launch: return
+        pyscfv_launch_viewer(tmpfile, options, section)
+        session.update(output=tmpfile, launched=True)
+    elif __pyscfv_isHttpViewer(options):
+        with pyscfv_timed('viewer-launch', section):
+            pyscfv_previewPublish(tmpfile)
+
+    if __pyscfv_DEBUG: console.write('Session at end of Callback FilterOnSave = {}\n'.format(session))
 
     # notify the UI that it's registered
     pyscfv_OverrideStatusBar(True)
 
-    return
-
 def pyscfv_Callback_BufferActivated_OverrideStatusBar(kwargs):
     """This callback will be run when a buffer is activated to override the status bar"""
     pyscfv_OverrideStatusBar(True)
     return
 
-# when i first load the library, clean out the tempdir
-pyscfv_cleanTempDir()
-
 # ##### GET RID OF THE LIBRARY-AS-SCRIPT BEHAVIOR!!!
 # if it's launched in main-mode, rather than imported, use the debug single filter
 #if __name__=='__main__':
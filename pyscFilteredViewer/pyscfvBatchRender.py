@@ -0,0 +1,67 @@
+# encoding=utf-8
+"""Runs every open file (or, from the command line, every file under the given folders) through its x-to-HTML filter, several at once
+
+From the PythonScript menu, this renders every file that is open in Notepad++ (and that has a section in
+the config file) in the background, and lists the results in the PythonScript console.
+
+From the command line (with the same python 2.7 that PythonScript uses), it doesn't need Notepad++ at all:
+    python pyscfvBatchRender.py [--config FILE] [--output FOLDER] [--workers N] PATH [PATH ...]
+renders every file under each PATH folder (or each PATH file) that a config section matches.
+"""
+
+import sys
+from os.path import dirname             # https://stackoverflow.com/a/3144107/5508606
+d = dirname(__file__)
+if not d in sys.path:
+    sys.path.append(d)
+
+def main(argv):
+    """the command-line batch renderer; returns the exit code"""
+    import os
+    import shutil
+    import argparse
+    import threading
+    import pyscFilteredViewerLibrary
+    parser = argparse.ArgumentParser(description='Runs every matching file through its pyscFilteredViewer filter, one per CPU at a time')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='a file or folder to render')
+    parser.add_argument('--config', help='the config file to use, instead of the one in the Notepad++ plugins\\config folder')
+    parser.add_argument('--output', metavar='FOLDER', help='also copy the filtered files here, as .html files in the same sub-folders as the sources')
+    parser.add_argument('--workers', type=int, help='how many filters to run at once (default: the number of CPUs)')
+    args = parser.parse_args(argv)
+
+    if args.config is not None:
+        pyscFilteredViewerLibrary.pyscfv_setConfigFile(args.config)
+    cfgDict = pyscFilteredViewerLibrary.pyscfv_getConfigDict()
+    files, roots = [], {}
+    for path in args.paths:
+        path = os.path.abspath(path)        # (the filters run in the temp folder, so relative paths wouldn't work for them)
+        if os.path.isdir(path):
+            found = pyscFilteredViewerLibrary.pyscfv_batchFilesInFolder(path, cfgDict)
+            roots.update( (fileName, path) for fileName, lang in found )
+        else:
+            found = [ (path, None) ]
+            roots[path] = os.path.dirname(path)
+        files.extend(found)
+
+    lock = threading.Lock()
+    def done(result):
+        with lock:          # (called from the worker threads)
+            sys.stdout.write( pyscFilteredViewerLibrary.pyscfv_batchSummaryLine(result) )
+            if args.output is not None and result['error'] is None:
+                relative = os.path.relpath(result['source'], roots[result['source']] or os.curdir)
+                copy = os.path.join(args.output, os.path.splitext(relative)[0] + '.html')
+                if not os.path.isdir(os.path.dirname(copy)):
+                    os.makedirs(os.path.dirname(copy))
+                shutil.copyfile(result['output'], copy)
+
+    results = pyscFilteredViewerLibrary.pyscfv_batchRender(files, cfgDict, args.workers, done)
+    pyscFilteredViewerLibrary.pyscfv_stopFilterServers()
+    failed = [ r for r in results if r['error'] is not None or r['exitcode'] ]
+    sys.stdout.write('rendered {} files, {} failed\n'.format(len(results), len(failed)))
+    return 1 if failed else 0
+
+if 'Npp' in sys.modules:
+    import pyscFilteredViewerLibrary
+    pyscFilteredViewerLibrary.pyscfv_BatchRenderOpenFiles()
+elif __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
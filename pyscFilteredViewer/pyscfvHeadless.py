@@ -0,0 +1,133 @@
+# encoding=utf-8
+"""Stand-ins for the parts of PythonScript's Npp module that pyscFilteredViewerLibrary uses
+
+pyscFilteredViewerLibrary falls back to this module when it's imported outside of Notepad++ (for example,
+when pyscfvBatchRender.py is run from the command line), so that it can filter files without an editor.
+There are no buffers until one is simulated with notepad.openBuffer(), so on its own only the functions
+that work on files (like pyscfv_batchRender) are useful.  The benchmark in the repository's bench folder
+(bench/Npp.py) uses this module too, with simulated buffers; notification callbacks are run synchronously
+(in the calling thread) by notepad.notify().
+
+Not intended for being run as a PythonScript script: PythonScript runs its scripts in the same namespace as its
+own Npp objects, so if it's run from the menu anyway, the real objects are put back (at the bottom of this file)
+"""
+import os
+import sys
+
+class _Enum(object):
+    """minimal stand-in for the PythonScript enums: attribute access to named values"""
+    def __init__(self, **values):
+        self.__dict__.update(values)
+
+LANGTYPE = _Enum(TXT=0, PHP=1, C=2, CPP=3, CS=4, OBJC=5, JAVA=6, RC=7, HTML=8, XML=9, MAKEFILE=10, PASCAL=11, BATCH=12, INI=13, ASCII=14, USER=15, PYTHON=22, PERL=21, MARKDOWN=1000)
+NOTIFICATION = _Enum(READY='READY', SHUTDOWN='SHUTDOWN', FILESAVED='FILESAVED', FILEBEFORESAVE='FILEBEFORESAVE', FILEOPENED='FILEOPENED', FILECLOSED='FILECLOSED', FILEBEFORECLOSE='FILEBEFORECLOSE', FILERENAMED='FILERENAMED', BUFFERACTIVATED='BUFFERACTIVATED', LANGCHANGED='LANGCHANGED')
+MESSAGEBOXFLAGS = _Enum(OK=0, OKCANCEL=1, YESNO=4, ICONERROR=16, ICONQUESTION=32, ICONWARNING=48, ICONINFORMATION=64)
+MESSAGEBOXRESULT = _Enum(OK=1, CANCEL=2, YES=6, NO=7)
+BUFFERENCODING = _Enum(ENC8BIT=0, UTF8=1, UCS2BE=2, UCS2LE=3, COOKIE=4)
+STATUSBARSECTION = _Enum(DOCTYPE=0, DOCSIZE=1, CURPOS=2, EOFFORMAT=3, UNICODETYPE=4, TYPINGMODE=5)
+
+class Console(object):
+    """the PythonScript console: writes to STDOUT (unless quiet is set), and errors to STDERR"""
+    def __init__(self):
+        self.quiet = False
+    def write(self, text):
+        if not self.quiet: sys.stdout.write(text)
+    def writeError(self, text):
+        sys.stderr.write(text)
+    def show(self):
+        pass
+    def hide(self):
+        pass
+    def clear(self):
+        pass
+
+class Notepad(object):
+    """the PythonScript notepad object, with simulated buffers"""
+    _NO_BUFFER = dict(filename=None, lang=LANGTYPE.TXT, text='', encoding=BUFFERENCODING.COOKIE)
+
+    def __init__(self):
+        self.buffers = {}           # bufferID => dict(filename, lang, text)
+        self.activeBufferID = None
+        self.callbacks = []         # [ (function, [notifications]) ]
+        self.statusBar = {}
+        self.messages = []          # every messageBox() call, for a harness to check
+        self.opened = []            # every open() call
+        self.pluginConfigDir = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), 'Notepad++', 'plugins', 'config')
+        self._nextBufferID = 1
+
+    # --- simulation helpers (not part of the real Npp module) ---
+    def openBuffer(self, filename, lang=LANGTYPE.TXT, text=None, encoding=BUFFERENCODING.COOKIE):
+        """simulates opening (and activating) a file; if text is None, the buffer shows the file's contents on disk"""
+        bufferID = self._nextBufferID
+        self._nextBufferID += 1
+        self.buffers[bufferID] = dict(filename=filename, lang=lang, text=text, encoding=encoding)
+        self.activeBufferID = bufferID
+        return bufferID
+
+    def notify(self, notification, **kwargs):
+        """runs every callback that is registered for notification, like Notepad++ does"""
+        kwargs.setdefault('code', notification)
+        for function, notifications in list(self.callbacks):
+            if notification in notifications:
+                function(dict(kwargs))
+
+    def _buffer(self, bufferID=None):
+        """the simulated buffer bufferID (default: the active one), or an empty stand-in if there isn't one"""
+        return self.buffers.get(self.activeBufferID if bufferID is None else bufferID, self._NO_BUFFER)
+
+    # --- the parts of the real notepad object that pyscFilteredViewer uses ---
+    def getCurrentFilename(self):
+        return self._buffer()['filename']
+    def getBufferFilename(self, bufferID=None):
+        return self._buffer(bufferID)['filename']
+    def getCurrentBufferID(self):
+        return self.activeBufferID
+    def activateBufferID(self, bufferID):
+        self.activeBufferID = bufferID
+    def getCurrentLang(self):
+        return self._buffer()['lang']
+    def getLangType(self, bufferID=None):
+        return self._buffer(bufferID)['lang']
+    def getEncoding(self, bufferID=None):
+        return self._buffer(bufferID)['encoding']
+    def getFiles(self):
+        return [ (b['filename'], bufferID, i, 0) for i, (bufferID, b) in enumerate(sorted(self.buffers.items())) ]
+    def getPluginConfigDir(self):
+        return self.pluginConfigDir
+    def messageBox(self, message, title='', flags=0):
+        self.messages.append( (title, message) )
+        if not console.quiet: sys.stderr.write('{}: {}\n'.format(title, message))
+        return MESSAGEBOXRESULT.OK
+    def open(self, filename):
+        self.opened.append(filename)
+    def callback(self, function, notifications):
+        self.callbacks.append( (function, list(notifications)) )
+        return True
+    def clearCallbacks(self, function=None):
+        self.callbacks = [ c for c in self.callbacks if function is not None and c[0] is not function ]
+    def setStatusBar(self, section, text):
+        self.statusBar[section] = text
+
+class Editor(object):
+    """the PythonScript editor object, reading from the active simulated buffer"""
+    def getText(self):
+        b = notepad._buffer()
+        if b['text'] is not None:
+            return b['text']
+        with open(b['filename'], 'rb') as f:
+            return f.read()
+    def setText(self, text):
+        notepad._buffer()['text'] = text
+    def getCodePage(self):
+        return 65001
+
+console = Console()
+notepad = Notepad()
+editor = Editor()
+
+__all__ = ['console', 'notepad', 'editor', 'LANGTYPE', 'NOTIFICATION', 'MESSAGEBOXFLAGS', 'MESSAGEBOXRESULT', 'BUFFERENCODING', 'STATUSBARSECTION']
+
+# run from the PythonScript menu, rather than imported: put back the real Npp objects that the stand-ins just replaced
+if __name__ == '__main__' and 'Npp' in sys.modules:
+    from Npp import *
+    console.write('pyscfvHeadless.py is only used by pyscFilteredViewerLibrary outside of Notepad++; there is nothing to run\n')
@@ -0,0 +1,12 @@
+# encoding=utf-8
+"""Prints how long each stage of filtering has been taking (per config section) to the PythonScript console
+"""
+
+import sys
+from os.path import dirname             # https://stackoverflow.com/a/3144107/5508606
+d = dirname(__file__)
+if not d in sys.path:
+    sys.path.append(d)
+
+import pyscFilteredViewerLibrary
+pyscFilteredViewerLibrary.pyscfv_showStats()